@@ -4,12 +4,15 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_QtReplaceWindow(object):
     def setupUi(self, QtReplaceWindow):
         QtReplaceWindow.setObjectName("QtReplaceWindow")
-        QtReplaceWindow.resize(500, 200)
+        QtReplaceWindow.resize(500, 230)
         self.pushButton_replace = QtWidgets.QPushButton(QtReplaceWindow)
-        self.pushButton_replace.setGeometry(QtCore.QRect(390, 160, 93, 28))
+        self.pushButton_replace.setGeometry(QtCore.QRect(390, 190, 93, 28))
         self.pushButton_replace.setObjectName("pushButton_replace")
+        self.pushButton_rules = QtWidgets.QPushButton(QtReplaceWindow)
+        self.pushButton_rules.setGeometry(QtCore.QRect(290, 190, 93, 28))
+        self.pushButton_rules.setObjectName("pushButton_rules")
         self.widget = QtWidgets.QWidget(QtReplaceWindow)
-        self.widget.setGeometry(QtCore.QRect(20, 90, 162, 72))
+        self.widget.setGeometry(QtCore.QRect(20, 90, 162, 120))
         self.widget.setObjectName("widget")
         self.verticalLayout = QtWidgets.QVBoxLayout(self.widget)
         self.verticalLayout.setContentsMargins(0, 0, 0, 0)
@@ -23,6 +26,12 @@ class Ui_QtReplaceWindow(object):
         self.checkBox_entirely = QtWidgets.QCheckBox(self.widget)
         self.checkBox_entirely.setObjectName("checkBox_entirely")
         self.verticalLayout.addWidget(self.checkBox_entirely)
+        self.checkBox_all_pages = QtWidgets.QCheckBox(self.widget)
+        self.checkBox_all_pages.setObjectName("checkBox_all_pages")
+        self.verticalLayout.addWidget(self.checkBox_all_pages)
+        self.checkBox_regex = QtWidgets.QCheckBox(self.widget)
+        self.checkBox_regex.setObjectName("checkBox_regex")
+        self.verticalLayout.addWidget(self.checkBox_regex)
         self.widget1 = QtWidgets.QWidget(QtReplaceWindow)
         self.widget1.setGeometry(QtCore.QRect(20, 20, 461, 57))
         self.widget1.setObjectName("widget1")
@@ -55,9 +64,12 @@ class Ui_QtReplaceWindow(object):
         _translate = QtCore.QCoreApplication.translate
         QtReplaceWindow.setWindowTitle(_translate("QtReplaceWindow", "Form"))
         self.pushButton_replace.setText(_translate("QtReplaceWindow", "Заменить"))
+        self.pushButton_rules.setText(_translate("QtReplaceWindow", "Правила..."))
         self.label_2.setText(_translate("QtReplaceWindow", "Параметры поиска:"))
         self.checkBox_register.setText(_translate("QtReplaceWindow", "Учитывать регистр"))
         self.checkBox_entirely.setText(_translate("QtReplaceWindow", "Только слово целиком"))
+        self.checkBox_all_pages.setText(_translate("QtReplaceWindow", "Во всех страницах"))
+        self.checkBox_regex.setText(_translate("QtReplaceWindow", "Регулярное выражение"))
         self.label.setText(_translate("QtReplaceWindow", "Найти:"))
         self.label_3.setText(_translate("QtReplaceWindow", "Заменить на:"))
 
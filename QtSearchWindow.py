@@ -4,7 +4,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_QtSearchWindow(object):
     def setupUi(self, QtSearchWindow):
         QtSearchWindow.setObjectName("QtSearchWindow")
-        QtSearchWindow.resize(500, 200)
+        QtSearchWindow.resize(500, 220)
         self.layoutWidget = QtWidgets.QWidget(QtSearchWindow)
         self.layoutWidget.setGeometry(QtCore.QRect(20, 30, 461, 24))
         self.layoutWidget.setObjectName("layoutWidget")
@@ -18,7 +18,7 @@ class Ui_QtSearchWindow(object):
         self.lineEdit_search.setObjectName("lineEdit_search")
         self.horizontalLayout.addWidget(self.lineEdit_search)
         self.layoutWidget1 = QtWidgets.QWidget(QtSearchWindow)
-        self.layoutWidget1.setGeometry(QtCore.QRect(20, 70, 162, 72))
+        self.layoutWidget1.setGeometry(QtCore.QRect(20, 70, 162, 96))
         self.layoutWidget1.setObjectName("layoutWidget1")
         self.verticalLayout = QtWidgets.QVBoxLayout(self.layoutWidget1)
         self.verticalLayout.setContentsMargins(0, 0, 0, 0)
@@ -32,8 +32,11 @@ class Ui_QtSearchWindow(object):
         self.checkBox_entirely = QtWidgets.QCheckBox(self.layoutWidget1)
         self.checkBox_entirely.setObjectName("checkBox_entirely")
         self.verticalLayout.addWidget(self.checkBox_entirely)
+        self.checkBox_all_pages = QtWidgets.QCheckBox(self.layoutWidget1)
+        self.checkBox_all_pages.setObjectName("checkBox_all_pages")
+        self.verticalLayout.addWidget(self.checkBox_all_pages)
         self.widget = QtWidgets.QWidget(QtSearchWindow)
-        self.widget.setGeometry(QtCore.QRect(190, 160, 295, 30))
+        self.widget.setGeometry(QtCore.QRect(190, 180, 295, 30))
         self.widget.setObjectName("widget")
         self.horizontalLayout_2 = QtWidgets.QHBoxLayout(self.widget)
         self.horizontalLayout_2.setContentsMargins(0, 0, 0, 0)
@@ -58,6 +61,7 @@ class Ui_QtSearchWindow(object):
         self.label_2.setText(_translate("QtSearchWindow", "Параметры поиска:"))
         self.checkBox_register.setText(_translate("QtSearchWindow", "Учитывать регистр"))
         self.checkBox_entirely.setText(_translate("QtSearchWindow", "Только слово целиком"))
+        self.checkBox_all_pages.setText(_translate("QtSearchWindow", "Во всех страницах"))
         self.pushButton_search_3.setText(_translate("QtSearchWindow", "Предыдущее"))
         self.pushButton_search_2.setText(_translate("QtSearchWindow", "Следующее"))
         self.pushButton_search.setText(_translate("QtSearchWindow", "Найти"))
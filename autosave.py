@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import sys
+import threading
+import zlib
+
+from PyQt5 import QtCore
+
+# Журнал автосохранения лежит рядом с базой стилей, но в отдельном файле
+JOURNAL_PATH = os.environ.get('TEXT_PROCESSOR_AUTOSAVE_PATH', 'text_processor_autosave.db')
+AUTOSAVE_INTERVAL_MS = int(os.environ.get('TEXT_PROCESSOR_AUTOSAVE_SECONDS', 30)) * 1000
+# После стольких записанных страниц из журнала удаляются устаревшие копии
+COMPACT_EVERY = 200
+COMPRESSION_LEVEL = 3
+
+CREATE_TABLES = (
+    "CREATE TABLE IF NOT EXISTS pages (id INTEGER PRIMARY KEY AUTOINCREMENT, page INTEGER NOT NULL, "
+    "html BLOB NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+)
+INSERT_PAGE = "INSERT INTO pages(page, html) VALUES(?, ?)"
+SET_META = "INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?)"
+SELECT_META = "SELECT key, value FROM meta"
+SELECT_LATEST = "SELECT page, html FROM pages WHERE id IN (SELECT MAX(id) FROM pages GROUP BY page)"
+DELETE_STALE = "DELETE FROM pages WHERE id NOT IN (SELECT MAX(id) FROM pages GROUP BY page)"
+
+
+class RecoveredDocument:
+    """Содержимое журнала после сбоя.
+
+    source - файл, из которого был открыт документ, если он не менялся
+    с тех пор; страницы pages накладываются поверх него.
+    """
+
+    def __init__(self, source, source_changed, page_count, pages):
+        self.source = source
+        self.source_changed = source_changed
+        self.page_count = page_count
+        self.pages = pages
+
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class Journal:
+    """Журнал изменённых страниц в SQLite: каждая запись - сжатый HTML одной страницы.
+
+    Записи только добавляются, при восстановлении берётся последняя копия
+    каждой страницы; compact() удаляет остальные. Как и в StyleRepository,
+    одно соединение в режиме WAL, запись сериализуется блокировкой.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        # Соединение открывается при первом обращении, обычно уже в потоке автосохранения, а не при запуске окна
+        self._connection = None
+        self._lock = threading.Lock()
+        self._appended = 0
+
+    def _connect(self):
+        """Соединение с журналом; вызывается под блокировкой."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # Журнал не должен ждать fsync на каждой записи: при сбое теряется не больше последней транзакции
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in CREATE_TABLES:
+                self._connection.execute(statement)
+        return self._connection
+
+    def start(self, source=None):
+        """Начинает журнал заново: документ только что открыт из source или сохранён в него."""
+        with self._lock, self._connect() as connection:
+            connection.execute("DELETE FROM pages")
+            connection.execute("DELETE FROM meta")
+            if source is not None:
+                connection.execute(SET_META, ('source', os.path.abspath(source)))
+                connection.execute(SET_META, ('source_signature', file_signature(source)))
+        self._appended = 0
+
+    def append(self, page_count, pages):
+        """Дописывает страницы (page, html); сжатие идёт до захвата блокировки."""
+        rows = [(page, zlib.compress(html.encode('utf-8'), COMPRESSION_LEVEL)) for page, html in pages]
+        with self._lock, self._connect() as connection:
+            connection.executemany(INSERT_PAGE, rows)
+            connection.execute(SET_META, ('page_count', str(page_count)))
+        self._appended += len(rows)
+        if self._appended >= COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        with self._lock, self._connect() as connection:
+            connection.execute(DELETE_STALE)
+        self._appended = 0
+
+    def clear(self):
+        with self._lock:
+            if self._connection is None and not os.path.exists(self.path):
+                return
+            with self._connect() as connection:
+                connection.execute("DELETE FROM pages")
+                connection.execute("DELETE FROM meta")
+        self._appended = 0
+
+    def load(self):
+        """RecoveredDocument или None, если восстанавливать нечего."""
+        with self._lock:
+            if self._connection is None and not os.path.exists(self.path):
+                return None
+            connection = self._connect()
+            meta = dict(connection.execute(SELECT_META))
+            rows = connection.execute(SELECT_LATEST).fetchall()
+        if not rows:
+            return None
+
+        source = meta.get('source')
+        source_changed = False
+        if source is not None:
+            try:
+                source_changed = file_signature(source) != meta.get('source_signature')
+            except OSError:
+                source_changed = True
+            if source_changed:
+                source = None
+        pages = {page: zlib.decompress(html).decode('utf-8') for page, html in rows}
+        return RecoveredDocument(source, source_changed, int(meta.get('page_count', max(pages))), pages)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class JournalTask(QtCore.QRunnable):
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function = function
+        self.args = args
+
+    def run(self):
+        # Исключение из QRunnable.run PyQt превращает в аварийное завершение программы
+        try:
+            self.function(*self.args)
+        except Exception as error:
+            print(f"Автосохранение: ошибка: {error!r}", file=sys.stderr)
+
+
+class Autosave(QtCore.QObject):
+    """Периодически дописывает в журнал страницы, изменённые с прошлого автосохранения.
+
+    В потоке интерфейса сериализуются только изменённые живые страницы;
+    чтение выгруженных страниц, сжатие и запись идут в отдельном потоке,
+    задачи выполняются по одной и по порядку.
+    """
+
+    def __init__(self, page_store, path=JOURNAL_PATH, interval=AUTOSAVE_INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        self.page_store = page_store
+        self.journal = Journal(path)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._pending = set()
+        self._closed = False
+        page_store.page_dirtied.connect(self.on_page_dirtied)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def on_page_dirtied(self, page):
+        self._pending.add(page)
+
+    def flush(self):
+        if self._closed:
+            return
+        pages = {page for page in self._pending if page in self.page_store}
+        self._pending.clear()
+        if not pages:
+            return
+        snapshot = self.page_store.snapshot(pages=pages)
+        page_count = max(self.page_store.keys())
+        self.pool.start(JournalTask(self.journal.append, page_count, snapshot.iter_html()))
+
+    def start_session(self, source=None):
+        """Документ совпадает с файлом source: журнал начинается заново.
+
+        Страницы, изменённые после снимка для сохранения, снова попадут в журнал.
+        """
+        if self._closed:
+            return
+        self._pending.clear()
+        self._pending.update(self.page_store.dirty_pages())
+        self.pool.start(JournalTask(self.journal.start, source))
+
+    def discard(self):
+        if self._closed:
+            return
+        self._pending.clear()
+        self.pool.start(JournalTask(self.journal.clear))
+
+    def close(self, keep):
+        """Останавливает автосохранение; при keep несохранённые правки остаются в журнале до следующего запуска.
+
+        После close() flush(), start_session() и discard() ничего не делают.
+        """
+        if self._closed:
+            return
+        self.timer.stop()
+        if keep:
+            self.flush()
+        else:
+            self.discard()
+        self._closed = True
+        self.pool.waitForDone()
+        self.journal.close()
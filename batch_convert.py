@@ -0,0 +1,183 @@
+"""Пакетное преобразование документов без окна.
+
+    python main.py convert in.html out.pdf
+    python main.py convert *.html --output-dir pdf --to pdf --style "Обычный" --rules rules.json
+
+Страницы раскладываются и печатаются теми же функциями, что и при
+сохранении из редактора. Файлы обрабатываются параллельно в процессах
+(по одному приложению Qt без экрана в каждом); для каждого файла
+печатается число страниц и время.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PyQt5 import QtGui
+from PyQt5.QtGui import QTextCursor, QTextDocument
+
+import document_loader
+import exporter
+import native_format
+import replace_engine
+import style_repository
+import text_workers
+from search_index import PageText
+from style_cache import build_block_format, build_char_format
+
+EXPORTERS = {
+    '.pdf': exporter.export_pdf,
+    '.html': exporter.export_html,
+    native_format.EXTENSION: native_format.export_native,
+}
+
+_app = None
+
+
+def start_qt():
+    """Приложение Qt без экрана: раскладке и печати нужны шрифты, но не окна."""
+    global _app
+    if _app is None:
+        os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+        _app = QtGui.QGuiApplication.instance() or QtGui.QGuiApplication(sys.argv[:1])
+    return _app
+
+
+def prepare_page(page, style, rules):
+    """Документ страницы с полями редактора, заменами по правилам и стилем на весь текст."""
+    document = QTextDocument()
+    if isinstance(page, native_format.NativePage):
+        page.build(document)
+    else:
+        document.setHtml(page)
+    exporter.apply_page_margins(document)
+
+    if rules:
+        steps = text_workers.substitute_text(rules, PageText.from_document(document).text())
+        if steps:
+            cursor = QTextCursor(document)
+            cursor.beginEditBlock()
+            for step in steps:
+                replace_engine.apply_edits(cursor, step)
+            cursor.endEditBlock()
+
+    if style is not None:
+        cursor = QTextCursor(document)
+        cursor.select(QTextCursor.Document)
+        cursor.mergeCharFormat(build_char_format(style))
+        cursor.mergeBlockFormat(build_block_format(style))
+    return document
+
+
+def iter_pages(source, extension, style, rules):
+    """(page, HTML или секция *.tpd) по одной странице; неизменяемые страницы не собираются в документ."""
+    native = extension == native_format.EXTENSION
+    for page, (start, end) in enumerate(source.page_ranges, 1):
+        if style is None and not rules:
+            if native and isinstance(source, native_format.NativeFile):
+                yield page, source.section(start, end)
+            else:
+                yield page, source.read(start, end)
+            continue
+        document = prepare_page(source.load(start, end), style, rules)
+        yield page, native_format.encode_document(document) if native else document.toHtml()
+
+
+def convert_file(input_path, output_path, style=None, rules=()):
+    """Преобразует один файл; формат результата - по расширению output_path. Возвращает (страниц, секунд)."""
+    start_qt()
+    started = time.perf_counter()
+    extension = os.path.splitext(output_path)[1].lower()
+    source = document_loader.open_document(input_path)
+    page_count = len(source.page_ranges)
+    EXPORTERS[extension](iter_pages(source, extension, style, rules), output_path, page_count)
+    return page_count, time.perf_counter() - started
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python main.py convert',
+                                     description="Преобразование документов без окна редактора")
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help="входной и выходной файл; с --output-dir - только входные файлы")
+    parser.add_argument('--output-dir', help="каталог для результатов; имя берётся от входного файла")
+    parser.add_argument('--to', default='pdf', choices=[extension[1:] for extension in EXPORTERS],
+                        help="формат результатов в --output-dir (по умолчанию pdf)")
+    parser.add_argument('--style', help="стиль из базы стилей, применяемый ко всему тексту")
+    parser.add_argument('--rules', help="правила замены в JSON (как у кнопки \"Правила...\")")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="число процессов")
+    args = parser.parse_args(argv)
+
+    if args.output_dir is None:
+        if len(args.paths) != 2:
+            parser.error("без --output-dir укажите один входной и один выходной файл")
+        args.tasks = [(args.paths[0], args.paths[1])]
+    else:
+        args.tasks = [(path, os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0] + '.' + args.to))
+                      for path in args.paths]
+    outputs = [output_path for _, output_path in args.tasks]
+    if len(set(outputs)) != len(outputs):
+        parser.error("у нескольких входных файлов совпадает имя результата")
+    for output_path in outputs:
+        if os.path.splitext(output_path)[1].lower() not in EXPORTERS:
+            parser.error(f"неизвестный формат результата: {output_path}")
+
+    args.style_object = None
+    if args.style is not None:
+        args.style_object = style_repository.get_repository().get_style(args.style)
+        if args.style_object is None:
+            parser.error(f"стиль \"{args.style}\" не найден в {style_repository.DATABASE_PATH}")
+    args.rule_list = []
+    if args.rules is not None:
+        try:
+            args.rule_list = replace_engine.load_rules(args.rules)
+        except (OSError, ValueError) as error:
+            parser.error(f"не удалось прочитать правила: {error}")
+    return args
+
+
+def report(input_path, output_path, result=None, error=None):
+    if error is not None:
+        print(f"{input_path}: ошибка: {error}", file=sys.stderr)
+    else:
+        page_count, elapsed = result
+        print(f"{input_path} -> {output_path}: {page_count} стр., {elapsed:.3f} с", flush=True)
+
+
+def run_cli(argv=None):
+    args = parse_args(argv)
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    failed = 0
+    jobs = max(1, min(args.jobs, len(args.tasks)))
+    if jobs == 1:
+        for input_path, output_path in args.tasks:
+            try:
+                result = convert_file(input_path, output_path, args.style_object, args.rule_list)
+            except Exception as error:
+                failed += 1
+                report(input_path, output_path, error=error)
+            else:
+                report(input_path, output_path, result)
+    else:
+        # spawn, а не fork: каждый процесс создаёт своё приложение Qt с нуля
+        with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=start_qt) as pool:
+            futures = {pool.submit(convert_file, input_path, output_path, args.style_object, args.rule_list):
+                       (input_path, output_path) for input_path, output_path in args.tasks}
+            for future in as_completed(futures):
+                input_path, output_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failed += 1
+                    report(input_path, output_path, error=error)
+                else:
+                    report(input_path, output_path, result)
+
+    print(f"Файлов: {len(args.tasks)}, ошибок: {failed}, процессов: {jobs}, "
+          f"всего: {time.perf_counter() - started:.3f} с")
+    return 1 if failed else 0
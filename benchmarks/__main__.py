@@ -0,0 +1,5 @@
+import sys
+
+from benchmarks.run import run_cli
+
+sys.exit(run_cli())
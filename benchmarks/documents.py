@@ -0,0 +1,33 @@
+import random
+
+import exporter
+
+WORDS = ("alpha beta gamma delta epsilon zeta theta kappa lambda sigma omega "
+         "текст абзац страница редактор поиск замена стиль шрифт документ").split()
+
+
+def make_page_html(page, paragraphs, words_per_paragraph, seed=0):
+    """HTML одной страницы: абзацы из случайных слов, часть слов выделена жирным или курсивом."""
+    rng = random.Random(seed * 100003 + page)
+    parts = []
+    for _ in range(paragraphs):
+        words = []
+        for _ in range(words_per_paragraph):
+            word = rng.choice(WORDS)
+            roll = rng.random()
+            if roll < 0.03:
+                word = f"<b>{word}</b>"
+            elif roll < 0.05:
+                word = f"<i>{word}</i>"
+            words.append(word)
+        parts.append(f"<p>{' '.join(words)}</p>")
+    return ''.join(parts)
+
+
+def make_pages(pages, paragraphs, words_per_paragraph, seed=0):
+    return {page: make_page_html(page, paragraphs, words_per_paragraph, seed) for page in range(1, pages + 1)}
+
+
+def write_html_file(file_path, pages):
+    """Пишет страницы в файл в том же виде, что и сохранение в HTML."""
+    exporter.export_html(sorted(pages.items()), file_path, len(pages))
@@ -0,0 +1,359 @@
+"""Замеры времени горячих операций редактора без экрана.
+
+Запуск из корня репозитория:
+
+    python -m benchmarks --pages 20 --paragraphs 200 --output result.json
+    python -m benchmarks --save-baseline        # записать benchmarks/baseline.json
+    python -m benchmarks --baseline benchmarks/baseline.json
+
+Каждая операция повторяется --repeat раз на синтетическом документе;
+в JSON пишутся медиана и перцентили в секундах. При сравнении с базовым
+замером операция считается замедлившейся, если её медиана выросла больше,
+чем на --tolerance, и тогда программа завершается с кодом 1.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtGui import QColor, QTextCharFormat, QTextCursor, QTextFormat
+
+import autosave
+import main
+import native_format
+import style_repository
+from benchmarks.documents import make_pages, write_html_file
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Допустимый рост медианы относительно базового замера
+DEFAULT_TOLERANCE = 0.2
+
+CREATE_STYLES = ("CREATE TABLE styles (id INTEGER UNIQUE NOT NULL PRIMARY KEY AUTOINCREMENT, shrift TEXT NOT NULL, "
+                 "pt TEXT NOT NULL, bold TEXT NOT NULL, italic TEXT NOT NULL, underlined TEXT NOT NULL, "
+                 "interval TEXT NOT NULL, color TEXT NOT NULL, name TEXT NOT NULL)")
+BENCHMARK_STYLE = "Замер"
+TYPED_TEXT = "быстрая проверка ввода текста "
+
+OPERATIONS = ('perform_search', 'replace_all', 'on_text_changed', 'change_page', 'open_html_file', 'save_as_html',
+              'open_native_file', 'save_as_native', 'save_as_pdf', 'apply_style')
+
+
+class SilentMessageBox(QtWidgets.QMessageBox):
+    """Окна сообщений на время замеров: не показываются и не ждут пользователя."""
+
+    def exec_(self):
+        return QtWidgets.QMessageBox.Ok
+
+    @staticmethod
+    def information(*args, **kwargs):
+        return QtWidgets.QMessageBox.Ok
+
+    warning = critical = question = information
+
+
+class FileDialogStub:
+    """Вместо диалога выбора файла возвращает заранее заданный путь."""
+    open_path = ""
+    save_path = ""
+    Options = QtWidgets.QFileDialog.Options
+
+    @classmethod
+    def getOpenFileName(cls, *args, **kwargs):
+        return cls.open_path, ""
+
+    @classmethod
+    def getSaveFileName(cls, *args, **kwargs):
+        return cls.save_path, ""
+
+
+def percentile(sorted_values, percent):
+    """Перцентиль по ближайшему рангу."""
+    index = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    values = sorted(samples)
+    middle = len(values) // 2
+    median = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+    return {
+        'runs': len(values),
+        'median': median,
+        'p90': percentile(values, 90),
+        'p95': percentile(values, 95),
+        'min': values[0],
+        'max': values[-1],
+    }
+
+
+def char_formats(document):
+    """[(позиция, текст, свойства формата символов)] фрагментов документа."""
+    fragments = []
+    block = document.begin()
+    while block.isValid():
+        iterator = block.begin()
+        while not iterator.atEnd():
+            fragment = iterator.fragment()
+            fragments.append((fragment.position(), fragment.text(), fragment.charFormat().properties()))
+            iterator += 1
+        block = block.next()
+    return fragments
+
+
+class Benchmark:
+    """Главное окно с синтетическим документом и набор замеряемых операций."""
+
+    def __init__(self, app, work_dir, pages, paragraphs, words):
+        self.app = app
+        self.work_dir = work_dir
+        self.pages = make_pages(pages, paragraphs, words)
+        self.html_path = os.path.join(work_dir, 'document.html')
+        self.native_path = os.path.join(work_dir, 'document' + native_format.EXTENSION)
+        write_html_file(self.html_path, self.pages)
+
+        # Стили и журнал автосохранения - во временных базах, рабочие не трогаются
+        style_repository.DATABASE_PATH = os.path.join(work_dir, 'styles.db')
+        with sqlite3.connect(style_repository.DATABASE_PATH) as connection:
+            connection.execute(CREATE_STYLES)
+        style_repository.get_repository().add_style(BENCHMARK_STYLE, "Arial", 14, True, False, True, 1.5, "#204080")
+        autosave.JOURNAL_PATH = os.path.join(work_dir, 'autosave.db')
+
+        main.QMessageBox = SilentMessageBox
+        main.QFileDialog = FileDialogStub
+        FileDialogStub.open_path = self.html_path
+
+        self.window = main.MainWindow()
+        self.window.show()
+        self.load_pages()
+        self.check_round_trip()
+        self.check_formats_kept()
+        # Тот же документ в *.tpd для замера открытия
+        self.save_as_native()
+
+        self.search_window = main.SearchWindow(self.window.text_edit, self.window)
+        self.search_window.checkBox_all_pages.setChecked(True)
+        self.replace_window = main.ReplaceWindow(self.window.text_edit, self.window)
+        self.replace_words = ("alpha", "omega")
+
+    def load_pages(self):
+        window = self.window
+        window.page_contents.clear()
+        for page, html in self.pages.items():
+            window.page_contents[page] = html
+        window.pages.setMaximum(len(self.pages))
+        window.go_to_page(1)
+        window.load_page_content()
+        window.page_contents.set_modified(False)
+
+    def check_round_trip(self):
+        """Открытие и сохранение без правок должно давать побайтно тот же файл."""
+        self.open_html_file()
+        round_trip_path = os.path.join(self.work_dir, 'round_trip.html')
+        self.window.save_as_html(round_trip_path)
+        self.wait_for_export()
+        with open(self.html_path, 'rb') as original, open(round_trip_path, 'rb') as saved:
+            if original.read() != saved.read():
+                raise RuntimeError("Открытие и сохранение без правок изменило файл " + self.html_path)
+        self.load_pages()
+
+    def check_formats_kept(self):
+        """Отступ и курсив меняют только формат: форматы символов остальных свойств не должны сбрасываться."""
+        window = self.window
+        document = window.text_edit.document()
+        cursor = QTextCursor(document)
+        cursor.setPosition(0)
+        cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+        char_format = QTextCharFormat()
+        char_format.setFontPointSize(24)
+        char_format.setForeground(QColor('red'))
+        cursor.mergeCharFormat(char_format)
+        window.apply_pending_format()
+        before = char_formats(document)
+
+        window.increase_indentation.click()
+        window.apply_pending_format()
+        if char_formats(document) != before:
+            raise RuntimeError("Изменение отступа сбросило форматы символов")
+
+        window.text_edit.setTextCursor(cursor)
+        window.toggle_italic()
+        window.apply_pending_format()
+        italic = {QTextFormat.FontItalic: window.italic_active}
+        expected = [(position, text, {**properties, **italic} if position < cursor.selectionEnd() else properties)
+                    for position, text, properties in before]
+        if char_formats(document) != expected:
+            raise RuntimeError("Курсив сбросил остальные свойства формата символов")
+
+        window.reduce_indentation.click()
+        window.toggle_italic()
+        self.load_pages()
+
+    def process_events(self):
+        self.app.processEvents()
+
+    def wait_for_export(self):
+        while self.window.export_thread is not None:
+            self.app.processEvents(QtCore.QEventLoop.WaitForMoreEvents)
+
+    def perform_search(self):
+        self.search_window.lineEdit_search.setText("gamma")
+        self.search_window.perform_search()
+
+    def replace_all(self):
+        # Замена туда и обратно: документ между повторами не меняется по объёму
+        self.replace_window.lineEdit_search2.setText(self.replace_words[0])
+        self.replace_window.lineEdit_replace.setText(self.replace_words[1])
+        self.replace_window.replace_all()
+        self.replace_words = self.replace_words[::-1]
+
+    def on_text_changed(self):
+        # Ввод по одному символу, как с клавиатуры, и отложенное переформатирование
+        cursor = self.window.text_edit.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        self.window.text_edit.setTextCursor(cursor)
+        for char in TYPED_TEXT:
+            self.window.text_edit.textCursor().insertText(char)
+        self.window.apply_pending_format()
+
+    def change_page(self):
+        page = self.window.current_page % len(self.pages) + 1
+        self.window.pages.setValue(page)
+        self.process_events()
+
+    def open_html_file(self):
+        FileDialogStub.open_path = self.html_path
+        self.window.page_contents.set_modified(False)
+        self.window.open_html_file()
+        self.process_events()
+
+    def open_native_file(self):
+        FileDialogStub.open_path = self.native_path
+        self.window.page_contents.set_modified(False)
+        self.window.open_html_file()
+        self.process_events()
+
+    def save_as_html(self):
+        self.window.save_as_html(os.path.join(self.work_dir, 'saved.html'))
+        self.wait_for_export()
+
+    def save_as_native(self):
+        self.window.save_as_native(self.native_path)
+        self.wait_for_export()
+
+    def save_as_pdf(self):
+        self.window.save_as_pdf(os.path.join(self.work_dir, 'saved.pdf'))
+        self.wait_for_export()
+
+    def apply_style(self):
+        self.window.text_edit.selectAll()
+        self.window.apply_style(BENCHMARK_STYLE)
+
+    def close(self):
+        self.wait_for_export()
+        self.window.page_contents.set_modified(False)
+        self.window.close()
+        style_repository.get_repository().close()
+
+
+def run(args):
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+    work_dir = tempfile.mkdtemp(prefix='text_processor_bench_')
+    try:
+        benchmark = Benchmark(app, work_dir, args.pages, args.paragraphs, args.words)
+        results = {}
+        for name in args.only or OPERATIONS:
+            operation = getattr(benchmark, name)
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                operation()
+                samples.append(time.perf_counter() - started)
+            # Между операциями документ возвращается в исходное состояние
+            benchmark.load_pages()
+            results[name] = summarize(samples)
+        benchmark.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'pages': args.pages,
+            'paragraphs': args.paragraphs,
+            'words': args.words,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'qt': QtCore.QT_VERSION_STR,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Добавляет в отчёт отношение медиан к базовому замеру; возвращает список замедлившихся операций."""
+    regressions = []
+    if baseline['meta'].get('pages') != report['meta']['pages'] or \
+            baseline['meta'].get('paragraphs') != report['meta']['paragraphs']:
+        print("Внимание: базовый замер сделан на документе другого размера", file=sys.stderr)
+
+    comparison = {}
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if not base or not base['median']:
+            continue
+        ratio = result['median'] / base['median']
+        comparison[name] = {'baseline_median': base['median'], 'ratio': ratio}
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    report['comparison'] = comparison
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Замеры операций редактора")
+    parser.add_argument('--pages', type=int, default=10, help="число страниц документа")
+    parser.add_argument('--paragraphs', type=int, default=100, help="абзацев на странице")
+    parser.add_argument('--words', type=int, default=40, help="слов в абзаце")
+    parser.add_argument('--repeat', type=int, default=10, help="повторов каждой операции")
+    parser.add_argument('--only', nargs='+', choices=OPERATIONS,
+                        metavar='NAME', help="замерить только указанные операции")
+    parser.add_argument('--output', help="куда записать JSON (по умолчанию - в stdout)")
+    parser.add_argument('--baseline', help="базовый замер для сравнения")
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, metavar='PATH',
+                        help=f"записать результат как базовый (по умолчанию {DEFAULT_BASELINE})")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="допустимый рост медианы, доля (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+def run_cli(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+    for name in regressions:
+        ratio = report['comparison'][name]['ratio']
+        print(f"Замедление: {name} - медиана x{ratio:.2f} от базовой", file=sys.stderr)
+    return 1 if regressions else 0
@@ -0,0 +1,99 @@
+import mmap
+
+import native_format
+from exporter import HTML_FOOTER, HTML_HEADER, PAGE_BREAK, PAGE_CLOSE, PAGE_OPEN
+
+CHUNK_SIZE = 1 << 20
+
+
+def scan_page_ranges(file, marker, chunk_size=CHUNK_SIZE):
+    """Читает файл блоками и отдаёт байтовые диапазоны (start, end) страниц между разделителями.
+
+    Буфер переиспользуется, поэтому при сканировании в памяти находится
+    не больше одного блока, а разделитель, разрезанный границей блока,
+    всё равно будет найден.
+    """
+    buffer = bytearray(chunk_size + len(marker))
+    view = memoryview(buffer)
+    keep = len(marker) - 1
+    base = 0
+    filled = 0
+    page_start = 0
+
+    while True:
+        read = file.readinto(view[filled:filled + chunk_size])
+        if not read:
+            break
+        filled += read
+
+        search_from = 0
+        while True:
+            index = buffer.find(marker, search_from, filled)
+            if index < 0:
+                break
+            yield page_start, base + index
+            page_start = base + index + len(marker)
+            search_from = index + len(marker)
+
+        tail_start = max(search_from, filled - keep)
+        tail = filled - tail_start
+        buffer[:tail] = buffer[tail_start:filled]
+        base += tail_start
+        filled = tail
+
+    yield page_start, base + filled
+
+
+def inner_page_ranges(data, page_ranges):
+    """Убирает из диапазонов обёртки, которые пишет export_html: заголовок, концовку и <div> вокруг страницы.
+
+    Остаются ровно байты HTML страниц, поэтому сохранение без правок
+    записывает тот же файл, а не вкладывает страницы в ещё один слой обёрток.
+    Файлы, записанные не редактором, остаются как есть.
+    """
+    header, footer = HTML_HEADER.encode('utf-8'), HTML_FOOTER.encode('utf-8')
+    opening, closing = PAGE_OPEN.encode('utf-8'), PAGE_CLOSE.encode('utf-8')
+    ranges = list(page_ranges)
+    for i, (start, end) in enumerate(ranges):
+        if i == 0 and data[start:start + len(header)] == header:
+            start += len(header)
+        if i == len(ranges) - 1 and end - start >= len(footer) and data[end - len(footer):end] == footer:
+            end -= len(footer)
+        if end - start >= len(opening) + len(closing) and data[start:start + len(opening)] == opening \
+                and data[end - len(closing):end] == closing:
+            start, end = start + len(opening), end - len(closing)
+        ranges[i] = (start, end)
+    return ranges
+
+
+class MappedFile:
+    """Файл, отображённый в память: страницы читаются из него только при первом показе."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            self.page_ranges = list(scan_page_ranges(self._file, PAGE_BREAK.encode('utf-8')))
+            self._file.seek(0, 2)
+            size = self._file.tell()
+            self._mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+            if self._mapping is not None:
+                self.page_ranges = inner_page_ranges(self._mapping, self.page_ranges)
+        except Exception:
+            self._file.close()
+            raise
+
+    def read(self, start, end):
+        if self._mapping is None:
+            return ""
+        return self._mapping[start:end].decode('utf-8', errors='replace')
+
+    def load(self, start, end):
+        return self.read(start, end)
+
+
+def open_document(file_path):
+    """Отображает в память файл *.tpd или HTML: формат определяется по содержимому, а не по расширению."""
+    if native_format.is_native_file(file_path):
+        return native_format.NativeFile(file_path)
+    return MappedFile(file_path)
@@ -0,0 +1,241 @@
+import contextlib
+import os
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import QRectF, QSizeF
+from PyQt5.QtGui import QPainter, QTextDocument, QTextFrameFormat
+
+PAGE_BREAK = "<div style='page-break-before:always;'></div>"
+HTML_HEADER = "<html><body>"
+HTML_FOOTER = "</body></html>"
+
+# Поля страницы PDF - как у QTextDocument.print_: 2 см в экранных пикселях,
+# раскладка сама масштабирует их под разрешение принтера
+PDF_MARGIN_CM = 2
+SCREEN_DPI = 96
+# Поля страницы в редакторе, в пикселях
+PAGE_MARGIN = 50
+COPY_CHUNK_SIZE = 1 << 20
+PAGE_OPEN = "<div>"
+PAGE_CLOSE = "</div>"
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class Unchanged:
+    """Источник страницы в снимке: страница не менялась с последнего сохранения и копируется из старого файла."""
+
+
+UNCHANGED = Unchanged()
+
+
+class SaveIndex:
+    """Байтовые диапазоны (start, end) HTML каждой страницы в сохранённом файле.
+
+    По индексу следующее сохранение в тот же файл копирует байты
+    неизменённых страниц, а не сериализует их заново. Индекс годен, пока
+    размер и время изменения файла те же, что и после записи.
+    """
+
+    def __init__(self, file_path, pages=None):
+        self.file_path = os.path.abspath(file_path)
+        self.pages = pages or {}
+        stat = os.stat(self.file_path)
+        self.stat = (stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def from_ranges(cls, file_path, page_ranges):
+        """Индекс только что открытого файла: страница i + 1 - байты page_ranges[i]."""
+        return cls(file_path, {i + 1: page_range for i, page_range in enumerate(page_ranges)})
+
+    def matches(self, file_path):
+        if os.path.abspath(file_path) != self.file_path:
+            return False
+        try:
+            stat = os.stat(self.file_path)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == self.stat
+
+
+def copy_range(source, target, start, end):
+    """Дописывает в target байты [start, end) файла source; на Linux - без копирования через Python."""
+    offset, remaining = start, end - start
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(source.fileno(), target.fileno(), remaining, offset)
+                if not copied:
+                    break
+                offset += copied
+                remaining -= copied
+        except OSError:
+            pass
+    source.seek(offset)
+    while remaining > 0:
+        chunk = source.read(min(remaining, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise IOError("Файл изменился во время сохранения")
+        target.write(chunk)
+        remaining -= len(chunk)
+
+
+def apply_page_margins(document):
+    """Поля страницы, как в редакторе; нужны и без окна, при пакетном преобразовании."""
+    page_format = QTextFrameFormat()
+    page_format.setLeftMargin(PAGE_MARGIN)
+    page_format.setRightMargin(PAGE_MARGIN)
+    page_format.setTopMargin(PAGE_MARGIN)
+    page_format.setBottomMargin(PAGE_MARGIN)
+    document.rootFrame().setFrameFormat(page_format)
+
+
+def report_progress(progress, done, total):
+    if progress is not None and progress(done, total) is False:
+        raise ExportCancelled()
+
+
+def export_html(pages, file_path, total=None, progress=None, previous=None):
+    """Пишет страницы (page, html) в файл по одной, не собирая документ целиком в памяти.
+
+    Вместо html может стоять UNCHANGED: тогда байты страницы копируются
+    из файла, описанного индексом previous прошлого сохранения.
+    Возвращает SaveIndex записанного файла.
+
+    progress(done, total) вызывается после каждой страницы; если он вернул
+    False, экспорт прерывается, а недописанный файл удаляется.
+    Запись идёт во временный файл рядом, который затем подменяет целевой:
+    страницы могут читаться из отображённого в память старого файла.
+    """
+    temp_path = file_path + '.tmp'
+    saved_pages = {}
+    source = None
+    try:
+        # Без буфера Python: позиция файла должна совпадать с позицией, которую сдвигает copy_file_range
+        with open(temp_path, 'wb', buffering=0) as file:
+            file.write(HTML_HEADER.encode('utf-8'))
+            for done, (page, html) in enumerate(pages):
+                if done:
+                    file.write(PAGE_BREAK.encode('utf-8'))
+                file.write(PAGE_OPEN.encode('utf-8'))
+                start = file.tell()
+                if html is UNCHANGED:
+                    if previous is None or not previous.matches(previous.file_path):
+                        raise IOError("Файл изменён другой программой, сохраните документ ещё раз")
+                    if source is None:
+                        source = open(previous.file_path, 'rb')
+                    copy_range(source, file, *previous.pages[page])
+                else:
+                    file.write(html.encode('utf-8'))
+                saved_pages[page] = (start, file.tell())
+                file.write(PAGE_CLOSE.encode('utf-8'))
+                report_progress(progress, done + 1, total)
+            file.write(HTML_FOOTER.encode('utf-8'))
+    except BaseException:
+        # Если временный файл так и не создан, исходная ошибка важнее FileNotFoundError
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+    finally:
+        if source is not None:
+            source.close()
+    os.replace(temp_path, file_path)
+    return SaveIndex(file_path, saved_pages)
+
+
+def create_pdf_printer(file_path):
+    # QtPrintSupport загружается только при первом экспорте в PDF
+    from PyQt5.QtPrintSupport import QPrinter
+
+    printer = QPrinter(QPrinter.HighResolution)
+    printer.setOutputFormat(QPrinter.PdfFormat)
+    printer.setOutputFileName(file_path)
+    return printer
+
+
+def layout_for_printer(html, printer):
+    """Раскладывает одну страницу редактора по листам принтера."""
+    document = QTextDocument()
+    document.documentLayout().setPaintDevice(printer)
+    document.setHtml(html)
+
+    frame_format = document.rootFrame().frameFormat()
+    frame_format.setMargin(int(PDF_MARGIN_CM / 2.54 * SCREEN_DPI))
+    document.rootFrame().setFrameFormat(frame_format)
+
+    document.setPageSize(QSizeF(printer.width(), printer.height()))
+    return document
+
+
+def export_pdf(pages, file_path, total=None, progress=None):
+    """Печатает страницы (page, html) в PDF по одной через QPainter.
+
+    Каждая страница редактора раскладывается отдельным QTextDocument и
+    начинается с нового листа, как раньше при page-break-before.
+    """
+    printer = create_pdf_printer(file_path)
+    painter = QPainter()
+    if not painter.begin(printer):
+        raise IOError(f"Не удалось открыть файл {file_path} для записи")
+
+    try:
+        # painter.end() дописывает и закрывает файл при любом исходе, в том числе при ошибке раскладки
+        try:
+            first_sheet = True
+            for done, (page, html) in enumerate(pages):
+                document = layout_for_printer(html, printer)
+                size = document.pageSize()
+                for sheet in range(document.pageCount()):
+                    if not first_sheet:
+                        printer.newPage()
+                    first_sheet = False
+
+                    painter.save()
+                    painter.translate(0, -sheet * size.height())
+                    document.drawContents(painter, QRectF(0, sheet * size.height(), size.width(), size.height()))
+                    painter.restore()
+                report_progress(progress, done + 1, total)
+        finally:
+            painter.end()
+    except ExportCancelled:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file_path)
+        raise
+
+
+class ExportThread(QtCore.QThread):
+    """Экспорт снимка страниц в фоновом потоке, чтобы редактор не зависал."""
+    progress_changed = QtCore.pyqtSignal(int, int)
+    export_finished = QtCore.pyqtSignal(str)
+    export_failed = QtCore.pyqtSignal(str)
+    export_cancelled = QtCore.pyqtSignal()
+
+    def __init__(self, export, snapshot, file_path, parent=None, **options):
+        super().__init__(parent)
+        self.export = export
+        self.snapshot = snapshot
+        self.file_path = file_path
+        self.options = options
+        # То, что вернул экспорт (для HTML - SaveIndex); читается после export_finished
+        self.result = None
+        self._cancel_requested = False
+
+    def cancel(self):
+        self._cancel_requested = True
+
+    def run(self):
+        try:
+            self.result = self.export(self.snapshot.iter_html(), self.file_path, len(self.snapshot), self._progress,
+                                      **self.options)
+        except ExportCancelled:
+            self.export_cancelled.emit()
+        except Exception as e:
+            self.export_failed.emit(str(e))
+        else:
+            self.export_finished.emit(self.file_path)
+
+    def _progress(self, done, total):
+        self.progress_changed.emit(done, total)
+        return not self._cancel_requested
@@ -0,0 +1,231 @@
+import os
+import re
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import QSize, QUrl
+from PyQt5.QtGui import QImage, QImageReader, QTextDocument, qRgb
+
+# Сколько мегабайт декодированных изображений держать в памяти на все страницы
+DEFAULT_CACHE_MB = int(os.environ.get('TEXT_PROCESSOR_IMAGE_CACHE_MB', 128))
+# Размер на странице дописывается к пути изображения: "photo.jpg#640x480"
+SIZE_FRAGMENT_RE = re.compile(r'(\d+)x(\d+)')
+PLACEHOLDER_COLOR = qRgb(224, 224, 224)
+
+
+def resource_name(path, width, height):
+    return f"{path}#{width}x{height}"
+
+
+def image_size(path):
+    """Размер изображения по заголовку файла, без декодирования; None, если файл не читается."""
+    size = QImageReader(path).size()
+    return size if size.isValid() else None
+
+
+def decode_image(path, width=None, height=None):
+    """Декодирует файл сразу в нужном размере: для JPEG это намного дешевле, чем полное декодирование."""
+    reader = QImageReader(path)
+    if width and height:
+        reader.setScaledSize(QSize(width, height))
+    return reader.read()
+
+
+def make_placeholder(width, height):
+    """Серый прямоугольник на время декодирования; монохромный, чтобы не занимать память."""
+    placeholder = QImage(max(1, width), max(1, height), QImage.Format_Mono)
+    placeholder.setColorTable([PLACEHOLDER_COLOR, PLACEHOLDER_COLOR])
+    placeholder.fill(0)
+    return placeholder
+
+
+class ImageCache:
+    """LRU-кэш декодированных изображений, ограниченный объёмом памяти.
+
+    Ключ - (путь, ширина, высота) на странице, поэтому одна фотография,
+    вставленная на несколько страниц в одном размере, декодируется один раз.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        image = self._images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._images.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        old = self._images.pop(key, None)
+        if old is not None:
+            self._bytes -= old.sizeInBytes()
+        self._images[key] = image
+        self._bytes += image.sizeInBytes()
+        self._evict()
+
+    def clear(self):
+        self._images.clear()
+        self._bytes = 0
+
+    def stats(self):
+        return {
+            'images': len(self._images),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def _evict(self):
+        # Последнее добавленное изображение остаётся, даже если одно оно больше лимита
+        while self._bytes > self.max_bytes and len(self._images) > 1:
+            _, image = self._images.popitem(last=False)
+            self._bytes -= image.sizeInBytes()
+
+
+class DecodeJobSignals(QtCore.QObject):
+    decoded = QtCore.pyqtSignal(object, QImage)
+
+
+class DecodeJob(QtCore.QRunnable):
+    def __init__(self, key):
+        super().__init__()
+        self.key = key
+        self.signals = DecodeJobSignals()
+
+    def run(self):
+        # QImage, в отличие от QPixmap, можно создавать вне потока интерфейса
+        self.signals.decoded.emit(self.key, decode_image(*self.key))
+
+
+class ImageLoader(QtCore.QObject):
+    """Декодирует изображения в пуле потоков и складывает их в общий кэш.
+
+    image_ready(key, image) приходит в потоке интерфейса; если файл
+    не удалось прочитать, image пустой.
+    """
+    image_ready = QtCore.pyqtSignal(object, QImage)
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.pool = QtCore.QThreadPool(self)
+        self._loading = set()
+        self._failed = set()
+
+    def request(self, key):
+        """Возвращает готовое изображение или None, поставив декодирование в очередь."""
+        image = self.cache.get(key)
+        if image is not None or key in self._failed:
+            return image
+        if key not in self._loading:
+            self._loading.add(key)
+            job = DecodeJob(key)
+            job.signals.decoded.connect(self.on_decoded)
+            self.pool.start(job)
+        return None
+
+    def is_failed(self, key):
+        return key in self._failed
+
+    def on_decoded(self, key, image):
+        self._loading.discard(key)
+        if image.isNull():
+            self._failed.add(key)
+        else:
+            self.cache.put(key, image)
+        self.image_ready.emit(key, image)
+
+    def shutdown(self):
+        """Отменяет ещё не начатые задачи и ждёт уже идущие."""
+        self.pool.clear()
+        self.pool.waitForDone()
+
+
+class PageDocument(QTextDocument):
+    """Документ страницы: изображения берутся из общего кэша уже в размере на странице.
+
+    Если изображения ещё нет в кэше, вместо него сразу отдаётся заглушка
+    того же размера, а декодирование идёт в фоне; готовая картинка
+    подменяет заглушку, и документ перекладывается.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pending = {}
+        self._image_sizes = {}
+        get_image_loader().image_ready.connect(self.on_image_ready)
+
+    def loadResource(self, type, url):
+        if type == QTextDocument.ImageResource:
+            path = url.toLocalFile() if url.isLocalFile() else url.toString(QUrl.RemoveFragment)
+            if os.path.isfile(path):
+                match = SIZE_FRAGMENT_RE.fullmatch(url.fragment())
+                if match:
+                    width, height = int(match.group(1)), int(match.group(2))
+                else:
+                    # <img width=... height=...> из открытого файла: декодируется тоже только нужный размер
+                    width, height = self.image_format_size(url.toString())
+                key = (path, width, height)
+                loader = get_image_loader()
+                image = loader.request(key)
+                if image is not None:
+                    return image
+                if not loader.is_failed(key):
+                    self._pending.setdefault(key, []).append(QUrl(url))
+                    if width is None:
+                        size = image_size(path) or QSize(1, 1)
+                        width, height = size.width(), size.height()
+                    return make_placeholder(width, height)
+        return super().loadResource(type, url)
+
+    def image_format_size(self, name):
+        """Размер, заданный у изображения в документе, или (None, None)."""
+        if name not in self._image_sizes:
+            self._image_sizes = {}
+            block = self.begin()
+            while block.isValid():
+                iterator = block.begin()
+                while not iterator.atEnd():
+                    format = iterator.fragment().charFormat()
+                    if format.isImageFormat():
+                        image_format = format.toImageFormat()
+                        width, height = round(image_format.width()), round(image_format.height())
+                        if width > 0 and height > 0:
+                            self._image_sizes.setdefault(image_format.name(), (width, height))
+                    iterator += 1
+                block = block.next()
+        return self._image_sizes.get(name, (None, None))
+
+    def on_image_ready(self, key, image):
+        urls = self._pending.pop(key, None)
+        if not urls or image.isNull():
+            return
+        for url in urls:
+            self.addResource(QTextDocument.ImageResource, url, image)
+        self.markContentsDirty(0, self.characterCount())
+
+
+_image_loader = None
+
+
+def get_image_loader():
+    """Общий на все страницы загрузчик изображений со своим кэшем."""
+    global _image_loader
+    if _image_loader is None:
+        _image_loader = ImageLoader(ImageCache())
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(_image_loader.shutdown)
+    return _image_loader
+
+
+def get_image_cache():
+    return get_image_loader().cache
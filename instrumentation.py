@@ -0,0 +1,193 @@
+import bisect
+import functools
+import inspect
+import json
+import os
+import time
+
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtGui import QTextDocument
+
+# TEXT_PROCESSOR_PROFILE=1 включает замеры обработчиков главного окна
+ENABLED = os.environ.get('TEXT_PROCESSOR_PROFILE') == '1'
+DUMP_PATH = os.environ.get('TEXT_PROCESSOR_PROFILE_DUMP', 'text_processor_profile.json')
+DUMP_INTERVAL_MS = 10000
+PANEL_UPDATE_MS = 1000
+# Верхние границы корзин гистограммы времени вызова, в миллисекундах
+HISTOGRAM_BOUNDS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SERIALIZATIONS = ((QTextDocument, 'toPlainText'), (QTextDocument, 'toHtml'),
+                  (QtWidgets.QTextEdit, 'toPlainText'), (QtWidgets.QTextEdit, 'toHtml'))
+
+
+class HandlerStats:
+    """Число вызовов, суммарное и максимальное время и гистограмма по HISTOGRAM_BOUNDS_MS."""
+    __slots__ = ('calls', 'total', 'max', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, elapsed * 1000)] += 1
+
+    def percentile_ms(self, percent):
+        """Верхняя граница корзины, в которую попадает перцентиль (для последней корзины - максимум)."""
+        rank = self.calls * percent / 100
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return HISTOGRAM_BOUNDS_MS[i] if i < len(HISTOGRAM_BOUNDS_MS) else self.max * 1000
+        return 0.0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.calls if self.calls else 0.0,
+            'max_ms': self.max * 1000,
+            'p95_ms': self.percentile_ms(95),
+            'histogram': dict(zip([f"<={bound}" for bound in HISTOGRAM_BOUNDS_MS] + ['>'], self.histogram)),
+        }
+
+
+class Profiler:
+    """Статистика обработчиков и сериализаций документа.
+
+    Действием пользователя считается внешний вызов обработчика: вложенные
+    вызовы (например, update_font -> merge_format_on_word_or_selection)
+    учитываются каждый в своей строке, а toPlainText()/toHtml() относятся
+    к действию, внутри которого они были вызваны.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.actions = {}
+        self._stack = []
+
+    def wrap(self, name, method):
+        # Слоты Qt вызываются с лишними аргументами сигнала, если метод их принимает,
+        # поэтому обёртка передаёт не больше аргументов, чем умеет принять сам метод
+        parameters = list(inspect.signature(method).parameters.values())
+        if any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters):
+            limit = None
+        else:
+            limit = len([parameter for parameter in parameters
+                         if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)])
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if limit is not None:
+                args = args[:limit]
+            return self.call(name, method, args, kwargs)
+        return wrapper
+
+    def call(self, name, method, args, kwargs):
+        outermost = not self._stack
+        if outermost:
+            self._stack.append({'toPlainText': 0, 'toHtml': 0})
+        else:
+            self._stack.append(None)
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.handlers.setdefault(name, HandlerStats()).add(time.perf_counter() - started)
+            counts = self._stack.pop()
+            if outermost:
+                action = self.actions.setdefault(name, {'actions': 0, 'toPlainText': 0, 'toHtml': 0})
+                action['actions'] += 1
+                action['toPlainText'] += counts['toPlainText']
+                action['toHtml'] += counts['toHtml']
+
+    def count_serialization(self, kind):
+        if self._stack:
+            self._stack[0][kind] += 1
+
+    def to_dict(self):
+        return {
+            'handlers': {name: stats.to_dict() for name, stats in sorted(self.handlers.items())},
+            'actions': {name: dict(counts) for name, counts in sorted(self.actions.items())},
+        }
+
+    def dump(self, file_path):
+        temp_path = file_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+        os.replace(temp_path, file_path)
+
+
+def count_serializations(profiler):
+    """Подменяет toPlainText()/toHtml() документа и редактора на считающие вызовы из Python."""
+    for cls, kind in SERIALIZATIONS:
+        original = getattr(cls, kind)
+
+        def counting(self, *args, _original=original, _kind=kind):
+            profiler.count_serialization(_kind)
+            return _original(self, *args)
+        setattr(cls, kind, counting)
+
+
+def instrument(cls, names, profiler):
+    """Оборачивает методы класса до создания окна, чтобы обёртки попали и в соединения сигналов."""
+    for name in names:
+        setattr(cls, name, profiler.wrap(name, getattr(cls, name)))
+
+
+class StatsPanel(QtWidgets.QDockWidget):
+    COLUMNS = ("Обработчик", "Вызовы", "Всего, мс", "Среднее, мс", "p95, мс", "Макс, мс",
+               "toPlainText / действие", "toHtml / действие")
+
+    def __init__(self, profiler, parent=None):
+        super().__init__("Профилирование", parent)
+        self.setObjectName("profiler_panel")
+        self.profiler = profiler
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        self.setWidget(self.table)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(PANEL_UPDATE_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        # Сверху - обработчики, на которые ушло больше всего времени
+        rows = sorted(self.profiler.handlers.items(), key=lambda item: item[1].total, reverse=True)
+        self.table.setRowCount(len(rows))
+        for row, (name, stats) in enumerate(rows):
+            action = self.profiler.actions.get(name)
+            per_action = ("", "")
+            if action and action['actions']:
+                per_action = (f"{action['toPlainText'] / action['actions']:.2f}",
+                              f"{action['toHtml'] / action['actions']:.2f}")
+            values = (name, str(stats.calls), f"{stats.total * 1000:.1f}",
+                      f"{stats.total * 1000 / stats.calls:.2f}", f"{stats.percentile_ms(95):g}",
+                      f"{stats.max * 1000:.1f}") + per_action
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
+
+
+profiler = Profiler()
+
+
+def attach(window):
+    """Добавляет окну панель статистики и периодическую запись её в DUMP_PATH."""
+    panel = StatsPanel(profiler, window)
+    window.addDockWidget(QtCore.Qt.RightDockWidgetArea, panel)
+
+    dump_timer = QtCore.QTimer(window)
+    dump_timer.setInterval(DUMP_INTERVAL_MS)
+    dump_timer.timeout.connect(lambda: profiler.dump(DUMP_PATH))
+    dump_timer.start()
+    QtWidgets.QApplication.instance().aboutToQuit.connect(lambda: profiler.dump(DUMP_PATH))
+    return panel
@@ -1,19 +1,78 @@
+import startup_timing
+import bisect
 import sys
 import re
-import sqlite3
-import webbrowser
 
 from PyQt5 import QtWidgets, QtGui, QtCore
 from PyQt5.QtCore import QUrl
-from PyQt5.QtGui import QTextCursor, QTextBlockFormat, QTextImageFormat, QPixmap, QTextDocument, QTextFrameFormat, QFont
-from PyQt5.QtWidgets import QColorDialog, QFileDialog, QMessageBox, QInputDialog, QWidget, QVBoxLayout, QRadioButton
-from PyQt5.QtPrintSupport import QPrinter
+from PyQt5.QtGui import QTextCursor, QTextBlockFormat, QTextImageFormat, QFont
+from PyQt5.QtWidgets import QColorDialog, QFileDialog, QMessageBox, QInputDialog, QProgressBar, QPushButton
 
 from QtMainWindow import Ui_color
 from QtSearchWindow import Ui_QtSearchWindow
 from QtReplaceWindow import Ui_QtReplaceWindow
 from QtStyles import Ui_Form
 from QtNewStyle import Ui_QtNewStyleWindow
+import autosave
+import document_loader
+import exporter
+import image_cache
+import instrumentation
+import native_format
+import replace_engine
+from style_cache import StyleListModel, get_style_cache
+from page_store import PageStore
+from search_index import SearchIndex, SearchJob
+
+startup_timing.mark("импорт модулей")
+
+# Задержка перед переформатированием введённого текста: серия нажатий обрабатывается за один раз
+FORMAT_DEBOUNCE_MS = 150
+# Пауза в наборе, после которой запускается поиск по мере ввода
+SEARCH_DEBOUNCE_MS = 250
+SEARCH_HIGHLIGHT_COLOR = 'yellow'
+CURRENT_MATCH_COLOR = 'orange'
+HIGHLIGHT_UPDATE_MS = 100
+
+
+def range_has_char_format(cursor, format):
+    """Проверяет, что у всего выделенного текста уже установлены свойства format."""
+    properties = format.properties()
+    start, end = cursor.selectionStart(), cursor.selectionEnd()
+    block = cursor.document().findBlock(start)
+    while block.isValid() and block.position() < end:
+        iterator = block.begin()
+        while not iterator.atEnd():
+            fragment = iterator.fragment()
+            if fragment.position() < end and fragment.position() + fragment.length() > start:
+                fragment_properties = fragment.charFormat().properties()
+                for key, value in properties.items():
+                    if fragment_properties.get(key) != value:
+                        return False
+            iterator += 1
+        block = block.next()
+    return True
+
+
+def range_has_line_height(cursor, line_height):
+    start, end = cursor.selectionStart(), cursor.selectionEnd()
+    block = cursor.document().findBlock(start)
+    while block.isValid() and block.position() <= end:
+        block_format = block.blockFormat()
+        if (block_format.lineHeightType() != QTextBlockFormat.ProportionalHeight
+                or block_format.lineHeight() != line_height):
+            return False
+        block = block.next()
+    return True
+
+
+class FormatBatch:
+    """Изменения формата, накопленные между begin_format_batch() и end_format_batch()."""
+
+    def __init__(self):
+        self.char_format = QtGui.QTextCharFormat()
+        self.block_format = QTextBlockFormat()
+        self.depth = 1
 
 
 class MainWindow(QtWidgets.QMainWindow, Ui_color):
@@ -21,9 +80,11 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
         super().__init__()
         self.setupUi(self)
         self.setWindowTitle("Текстовый редактор")
-        self.search_window = SearchWindow(self.text_edit)
-        self.replace_window = ReplaceWindow(self.text_edit)
-        self.style_window = StyleWindow()
+        startup_timing.mark("setupUi")
+        # Диалоги создаются при первом открытии: до первой отрисовки окна они не нужны
+        self.search_window = None
+        self.replace_window = None
+        self.style_window = None
 
         self.search.clicked.connect(self.open_search_window)
         self.replace.clicked.connect(self.open_replace_window)
@@ -43,33 +104,78 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
         self.paste.clicked.connect(self.insert_image)
         self.link.clicked.connect(self.add_link)
         self.text_edit.selectionChanged.connect(self.update_open_link)
-        self.text_edit.textChanged.connect(self.on_text_changed)
-        self.style_window.style_selected.connect(self.apply_style)
 
         self.bold_active = False
         self.italic_active = False
         self.underlined_active = False
         self.current_text_color = QtGui.QColor('black')
-        self.page_contents = {}
+        self.ignore_text_change = False
+        # Нажатая клавиша заменяет выделение: изменение с removed == added тогда - ввод, а не смена формата
+        self.typing_over_selection = False
+        self.text_edit.installEventFilter(self)
+        # Пока открыта пачка, merge_format_on_word_or_selection() и merge_block_format() только копят изменения
+        self.format_batch = None
+
+        # Диапазон вставленного текста, который ещё нужно отформатировать.
+        # QTextCursor сам сдвигает свои позиции при последующих правках.
+        self.pending_format_cursor = None
+        self.format_timer = QtCore.QTimer(self)
+        self.format_timer.setSingleShot(True)
+        self.format_timer.setInterval(FORMAT_DEBOUNCE_MS)
+        self.format_timer.timeout.connect(self.apply_pending_format)
+
+        self.export_thread = None
+        self.export_format_name = None
+        # Страницы, которые сохраняет текущий экспорт; при ошибке они снова считаются изменёнными
+        self.export_dirty_pages = set()
+        # Где лежат страницы в последнем сохранённом или открытом HTML: неизменённые копируются оттуда
+        self.html_save_index = None
+        self.export_progress = QProgressBar()
+        self.export_progress.setMaximumWidth(200)
+        self.export_progress.hide()
+        self.export_cancel = QPushButton("Отменить")
+        self.export_cancel.clicked.connect(self.cancel_export)
+        self.export_cancel.hide()
+        self.statusBar().addPermanentWidget(self.export_progress)
+        self.statusBar().addPermanentWidget(self.export_cancel)
+
+        self.connected_document = None
+        self.page_contents = PageStore(prepare_document=self.apply_page_margins, parent=self)
+        self.page_contents.pages_cleared.connect(self.forget_save_index)
+        self.search_index = SearchIndex(self.page_contents, self)
+        self.autosave = autosave.Autosave(self.page_contents, autosave.JOURNAL_PATH, parent=self)
         self.current_page = 1
         self.pages.setMinimum(1)
         self.pages.setValue(1)
         self.ignore_modifications = False
         self.indent_value = 0
-        self.previous_text = self.text_edit.toPlainText()
 
         self.update_font()
         self.update_font_size()
         self.load_page_content()
         self.set_page_margins()
+        self.page_contents.set_modified(False)
+        startup_timing.mark("первая страница")
+
+        if instrumentation.ENABLED:
+            instrumentation.attach(self)
+        # Журнал проверяется после показа окна, чтобы вопрос о восстановлении не задерживал запуск
+        QtCore.QTimer.singleShot(0, self.offer_restore)
 
     def open_search_window(self):
+        if self.search_window is None:
+            self.search_window = SearchWindow(self.text_edit, self)
         self.search_window.show()
 
     def open_replace_window(self):
+        if self.replace_window is None:
+            self.replace_window = ReplaceWindow(self.text_edit, self)
         self.replace_window.show()
 
     def open_style_window(self):
+        if self.style_window is None:
+            self.style_window = StyleWindow()
+            self.style_window.style_selected.connect(self.apply_style)
         self.style_window.show()
 
     def save_document(self):
@@ -87,10 +193,11 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
         if reply == QMessageBox.Cancel:
             return
 
-        self.page_contents[self.current_page] = self.text_edit.toHtml()
+        self.apply_pending_format()
 
         options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getSaveFileName(self, "Save File", "", "HTML Files (*.html);;PDF Files (*.pdf)",
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save File", "",
+                                                   "Документ (*.tpd);;HTML Files (*.html);;PDF Files (*.pdf)",
                                                    options=options)
 
         if file_path:
@@ -98,56 +205,143 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
                 self.save_as_pdf(file_path)
             elif file_path.endswith('.html'):
                 self.save_as_html(file_path)
+            elif file_path.endswith(native_format.EXTENSION):
+                self.save_as_native(file_path)
 
     def save_as_pdf(self, file_path):
-        try:
-            printer = QPrinter(QPrinter.HighResolution)
-            printer.setOutputFormat(QPrinter.PdfFormat)
-            printer.setOutputFileName(file_path)
-
-            final_document = QTextDocument()
+        self.export_document(exporter.export_pdf, file_path, "PDF")
 
-            full_html = "<html><body>"
-            for page in sorted(self.page_contents.keys()):
-                text = self.page_contents.get(page, "")
-                if page != min(self.page_contents.keys()):
-                    full_html += "<div style='page-break-before:always;'></div>"
-                full_html += f"<div>{text}</div>"
-
-            full_html += "</body></html>"
+    def save_as_html(self, file_path):
+        self.export_document(exporter.export_html, file_path, "HTML", incremental=True)
 
-            final_document.setHtml(full_html)
-            final_document.print_(printer)
+    def save_as_native(self, file_path):
+        self.export_document(native_format.export_native, file_path, "TPD", native=True)
 
-            self.text_edit.document().setModified(False)
+    def export_document(self, export, file_path, format_name, incremental=False, native=False):
+        if self.export_thread is not None:
+            QMessageBox.information(self, "Сохранение", "Дождитесь окончания текущего сохранения.")
+            return
 
-            QMessageBox.information(self, "Сохранение завершено", f"Документ сохранен по пути {file_path}")
+        # HTML неизменённых с прошлого сохранения страниц не сериализуется, а копируется из прошлого файла
+        options = {}
+        unchanged = set()
+        self.export_dirty_pages = set()
+        if incremental:
+            self.export_dirty_pages = self.page_contents.take_dirty()
+            index = self.html_save_index
+            if index is not None and index.matches(index.file_path):
+                unchanged = set(index.pages) - self.export_dirty_pages
+                options['previous'] = index
+
+        # Экспорт идёт по снимку страниц, поэтому редактирование во время сохранения безопасно
+        snapshot = self.page_contents.snapshot(unchanged, native=native)
+        self.page_contents.set_modified(False)
+
+        self.export_format_name = format_name
+        self.export_thread = exporter.ExportThread(export, snapshot, file_path, self, **options)
+        self.export_thread.progress_changed.connect(self.on_export_progress)
+        self.export_thread.export_finished.connect(self.on_export_finished)
+        self.export_thread.export_failed.connect(self.on_export_failed)
+        self.export_thread.export_cancelled.connect(self.on_export_cancelled)
+
+        self.export_progress.setRange(0, len(snapshot))
+        self.export_progress.setValue(0)
+        self.export_progress.show()
+        self.export_cancel.show()
+        self.export_thread.start()
+
+    def cancel_export(self):
+        if self.export_thread is not None:
+            self.export_thread.cancel()
+
+    def on_export_progress(self, done, total):
+        self.export_progress.setValue(done)
+
+    def on_export_finished(self, file_path):
+        if isinstance(self.export_thread.result, exporter.SaveIndex):
+            self.html_save_index = self.export_thread.result
+        if self.export_format_name != "PDF":
+            self.autosave.start_session(file_path)
+        self.finish_export()
+        QMessageBox.information(self, "Сохранение завершено", f"Документ сохранен по пути {file_path}")
+
+    def on_export_failed(self, error):
+        self.finish_export()
+        self.page_contents.set_modified(True)
+        self.page_contents.mark_dirty(self.export_dirty_pages)
+        QMessageBox.critical(self, "Ошибка сохранения",
+                             f"Произошла ошибка при сохранении {self.export_format_name}: {error}")
+
+    def on_export_cancelled(self):
+        self.finish_export()
+        self.page_contents.set_modified(True)
+        self.page_contents.mark_dirty(self.export_dirty_pages)
+
+    def finish_export(self):
+        self.export_thread.wait()
+        self.export_thread.deleteLater()
+        self.export_thread = None
+        self.export_progress.hide()
+        self.export_cancel.hide()
+
+    def wait_for_export(self):
+        """Дожидается сохранения и сразу обрабатывает его результат (export_finished или export_failed).
+
+        Сигналы потока экспорта приходят через очередь событий; без этого они
+        были бы обработаны уже после закрытия журнала автосохранения.
+        """
+        if self.export_thread is not None:
+            self.export_thread.wait()
+            QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.MetaCall)
+
+    def forget_save_index(self):
+        self.html_save_index = None
+
+    def offer_restore(self):
+        recovered = self.autosave.journal.load()
+        if recovered is None:
+            self.autosave.discard()
+            return
 
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка сохранения", f"Произошла ошибка при сохранении PDF: {str(e)}")
+        question = "Найдены несохранённые изменения документа, программа была закрыта аварийно. Восстановить их?"
+        if recovered.source_changed:
+            question += "\nИсходный файл с тех пор изменён, будут восстановлены только изменённые страницы."
+        reply = QMessageBox.question(self, "Восстановление", question, QMessageBox.Yes | QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            self.autosave.discard()
+            return
 
-    def save_as_html(self, file_path):
         try:
-            full_html = "<html><body>"
-            for page in sorted(self.page_contents.keys()):
-                text = self.page_contents.get(page, "")
-                if page != min(self.page_contents.keys()):
-                    full_html += "<div style='page-break-before:always;'></div>"
-                full_html += f"<div>{text}</div>"
-            full_html += "</body></html>"
-
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(full_html)
-
-            self.text_edit.document().setModified(False)
+            self.restore_document(recovered)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка восстановления", f"Не удалось восстановить документ: {str(e)}")
+
+    def restore_document(self, recovered):
+        """Открывает исходный файл, если он есть, и накладывает поверх страницы из журнала."""
+        self.page_contents.clear()
+        if recovered.source is not None:
+            mapped_file = document_loader.open_document(recovered.source)
+            for i, (start, end) in enumerate(mapped_file.page_ranges):
+                self.page_contents.set_mapped(i + 1, mapped_file, start, end)
+            if isinstance(mapped_file, document_loader.MappedFile):
+                self.html_save_index = exporter.SaveIndex.from_ranges(recovered.source, mapped_file.page_ranges)
+        for page, html in recovered.pages.items():
+            self.page_contents[page] = html
 
-            QMessageBox.information(self, "Сохранение завершено", f"Документ сохранен по пути {file_path}")
+        self.current_page = 1
+        self.pages.setMaximum(max(recovered.page_count, len(self.page_contents), 1))
+        self.pages.setValue(1)
+        self.ignore_modifications = True
+        self.load_page_content()
+        self.ignore_modifications = False
+        self.page_contents.set_modified(True)
 
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка сохранения", f"Произошла ошибка при сохранении HTML: {str(e)}")
+        # Журнал начинается заново с восстановленными страницами
+        self.autosave.start_session(recovered.source)
+        self.autosave.flush()
 
     def open_html_file(self):
-        if not self.text_edit.document().isEmpty() and self.text_edit.document().isModified():
+        if self.page_contents.is_modified():
             unsaved_warning_message = (
                 "У вас есть несохраненные данные. Они будут утеряны при открытии нового файла. Продолжить?")
             message_box = QMessageBox()
@@ -163,25 +357,26 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
             if message_box.clickedButton() == cancel_button:
                 return
 
-        self.page_contents[self.current_page] = self.text_edit.toHtml()
-
         self.current_page = 1
         self.pages.setValue(1)
 
         options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getOpenFileName(self, "Открыть файл", "", "HTML Files (*.html);;All Files (*)",
+        file_path, _ = QFileDialog.getOpenFileName(self, "Открыть файл", "",
+                                                   "Документы (*.tpd *.html);;HTML Files (*.html);;All Files (*)",
                                                    options=options)
 
         if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    html_content = file.read()
+                # Запоминаются только границы страниц, страница читается при её первом показе
+                mapped_file = document_loader.open_document(file_path)
 
                 self.page_contents.clear()
-                self.text_edit.clear()
 
-                pages = html_content.split("<div style='page-break-before:always;'></div>")
-                self.page_contents = {i + 1: page for i, page in enumerate(pages)}
+                for i, (start, end) in enumerate(mapped_file.page_ranges):
+                    self.page_contents.set_mapped(i + 1, mapped_file, start, end)
+                # Первое же сохранение открытого HTML копирует из него нетронутые страницы
+                if isinstance(mapped_file, document_loader.MappedFile):
+                    self.html_save_index = exporter.SaveIndex.from_ranges(file_path, mapped_file.page_ranges)
 
                 self.current_page = 1
                 self.pages.setMinimum(1)
@@ -191,94 +386,171 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
                 self.load_page_content()
                 self.ignore_modifications = False
 
-                self.text_edit.document().setModified(False)
+                self.page_contents.set_modified(False)
+                self.autosave.start_session(file_path)
 
                 QMessageBox.information(self, "Загрузка завершена", f"Документ успешно загружен из {file_path}")
 
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка загрузки", f"Произошла ошибка при загрузке HTML: {str(e)}")
 
-    def on_text_changed(self):
-        if self.ignore_text_change:  # Проверяем флаг
+    def eventFilter(self, watched, event):
+        if watched is self.text_edit:
+            if event.type() == QtCore.QEvent.KeyPress:
+                # Управляющие сочетания (Ctrl+Z и т.п.) тоже дают event.text(), но не вводят его
+                text = event.text()
+                typed = bool(text) and (text.isprintable() or text in '\r\t') or event.matches(QtGui.QKeySequence.Paste)
+                self.typing_over_selection = typed and self.text_edit.textCursor().hasSelection()
+            elif event.type() == QtCore.QEvent.InputMethod:
+                self.typing_over_selection = bool(event.commitString()) and self.text_edit.textCursor().hasSelection()
+        return super().eventFilter(watched, event)
+
+    def on_text_changed(self, position, removed, added):
+        typing_over_selection, self.typing_over_selection = self.typing_over_selection, False
+        if self.ignore_text_change:
             return
 
-        text = self.text_edit.toPlainText()
-        self.text_edit.textChanged.disconnect(self.on_text_changed)
+        document = self.text_edit.document()
+        if document.isEmpty():
+            self.text_edit.mergeCurrentCharFormat(self.current_char_format())
+            return
 
-        if not text or text != self.previous_text:
-            self.update_font()
-            self.update_line_spacing()
-            self.update_font_size()
+        # Удаление текста и изменение только формата (removed == added) не требуют переформатирования;
+        # исключение - ввод поверх выделения той же длины
+        if added == 0 or removed == added and not typing_over_selection:
+            return
 
-            self.bold_active = not self.bold_active
-            self.italic_active = not self.italic_active
-            self.underlined_active = not self.underlined_active
+        end = min(position + added, document.characterCount() - 1)
+        if self.pending_format_cursor is None:
+            self.pending_format_cursor = QTextCursor(document)
+            self.pending_format_cursor.setPosition(position)
+            self.pending_format_cursor.setPosition(end, QTextCursor.KeepAnchor)
+        else:
+            start = min(position, self.pending_format_cursor.selectionStart())
+            end = max(end, self.pending_format_cursor.selectionEnd())
+            self.pending_format_cursor.setPosition(start)
+            self.pending_format_cursor.setPosition(end, QTextCursor.KeepAnchor)
 
-            self.toggle_bold()
-            self.toggle_italic()
-            self.toggle_underlined()
+        self.format_timer.start()
 
-            self.current_text_color = self.current_text_color
-            format = QtGui.QTextCharFormat()
-            format.setForeground(self.current_text_color)
-            self.merge_format_on_word_or_selection(format)
-            self.previous_text = text
+    def current_char_format(self):
+        """Один формат символов, собранный из текущего состояния панели инструментов."""
+        format = QtGui.QTextCharFormat()
+        format.setFontFamily(self.font.currentFont().family())
+        format.setFontPointSize(int(self.font_size.currentText()))
+        format.setFontWeight(QtGui.QFont.Bold if self.bold_active else QtGui.QFont.Normal)
+        format.setFontItalic(self.italic_active)
+        format.setFontUnderline(self.underlined_active)
+        format.setForeground(self.current_text_color)
+        return format
 
-        self.text_edit.textChanged.connect(self.on_text_changed)
+    def current_block_format(self):
+        """Формат абзаца с межстрочным интервалом из панели инструментов (None, если он не задан числом)."""
+        try:
+            spacing = float(self.size_interval.currentText())
+        except ValueError:
+            return None
+        block_format = QTextBlockFormat()
+        block_format.setLineHeight(spacing * 100, QTextBlockFormat.ProportionalHeight)
+        return block_format
 
-    def apply_style(self, style_name):
-        conn = sqlite3.connect('text_processor.db')
-        cur = conn.cursor()
+    def begin_format_batch(self):
+        if self.format_batch is None:
+            self.format_batch = FormatBatch()
+        else:
+            self.format_batch.depth += 1
 
-        cur.execute("SELECT * FROM styles WHERE name = ?", (style_name,))
-        style = cur.fetchone()
+    def end_format_batch(self):
+        """Применяет всё накопленное в пачке одним проходом курсора по слову или выделению."""
+        batch = self.format_batch
+        batch.depth -= 1
+        if batch.depth:
+            return
+        self.format_batch = None
 
-        if style:
-            font_family = style[1]
-            font_size = style[2]
-            is_bold = style[3]
-            if is_bold == "True":
-                is_bold = True
-            else:
-                is_bold = False
-            is_italic = style[4]
-            if is_italic == "True":
-                is_italic = True
-            else:
-                is_italic = False
-            is_underline = style[5]
-            if is_underline == "True":
-                is_underline = True
-            else:
-                is_underline = False
-            line_spacing = style[6]
-            font_color = style[7]
+        cursor = self.text_edit.textCursor()
+        if not cursor.hasSelection():
+            cursor.select(QTextCursor.WordUnderCursor)
+        self.apply_formats(cursor, batch.char_format, batch.block_format)
 
-            format = QtGui.QTextCharFormat()
-            format.setForeground(QtGui.QColor(font_color))
-            self.merge_format_on_word_or_selection(format)
-            self.current_text_color = QtGui.QColor(font_color)
-            self.text_color.setStyleSheet(f'background-color: {font_color}' if font_color != QtGui.QColor('black')
-                                          else 'background-color: none')
+    def apply_formats(self, cursor, char_format=None, block_format=None):
+        """Накладывает формат символов и абзаца на выделение курсора одним блоком редактирования (один шаг отмены)."""
+        has_char_format = char_format is not None and char_format.propertyCount() > 0
+        has_block_format = block_format is not None and block_format.propertyCount() > 0
+        if not has_char_format and not has_block_format:
+            return
+
+        self.ignore_text_change = True
+        cursor.beginEditBlock()
+        if has_char_format:
+            cursor.mergeCharFormat(char_format)
+            # Формат ввода - внутри того же блока: при выделении он тоже меняет документ
+            self.text_edit.mergeCurrentCharFormat(char_format)
+        if has_block_format:
+            cursor.mergeBlockFormat(block_format)
+        cursor.endEditBlock()
+        self.ignore_text_change = False
+
+    def reapply_toolbar_format(self):
+        """Возвращает слову под курсором формат панели инструментов после вставки."""
+        self.begin_format_batch()
+        self.merge_format_on_word_or_selection(self.current_char_format())
+        block_format = self.current_block_format()
+        if block_format is not None:
+            self.merge_block_format(block_format)
+        self.end_format_batch()
+
+    def apply_pending_format(self):
+        cursor = self.pending_format_cursor
+        self.pending_format_cursor = None
+        if cursor is None or cursor.document() is not self.text_edit.document() or not cursor.hasSelection():
+            return
 
-            self.size_interval.setCurrentText(line_spacing)
-            font = QFont(font_family)
-            self.font.setCurrentFont(font)
+        format = self.current_char_format()
+        block_format = self.current_block_format()
 
-            self.font_size.setCurrentText(font_size)
+        # Уже оформленный диапазон не трогается: повторное слияние формата создало бы лишний шаг отмены
+        if range_has_char_format(cursor, format):
+            format = None
+        if block_format is not None and range_has_line_height(cursor, block_format.lineHeight()):
+            block_format = None
+        self.apply_formats(cursor, format, block_format)
 
-            self.update_font()
-            self.update_line_spacing()
-            self.update_font_size()
+    def apply_style(self, style_name):
+        style_cache = get_style_cache()
+        style = style_cache.style(style_name)
 
-            self.bold_active = not is_bold
-            self.italic_active = not is_italic
-            self.underlined_active = not is_underline
+        if style:
+            # Панель инструментов только отражает стиль: её обработчики не должны форматировать текст по одному свойству
+            toolbar = (self.font, self.font_size, self.size_interval)
+            for widget in toolbar:
+                widget.blockSignals(True)
+            self.font.setCurrentFont(QFont(style.font_family))
+            self.font_size.setCurrentText(str(style.font_size))
+            self.size_interval.setCurrentText(str(style.line_spacing))
+            for widget in toolbar:
+                widget.blockSignals(False)
+
+            self.bold_active = style.bold
+            self.italic_active = style.italic
+            self.underlined_active = style.underlined
+            self.update_format_buttons()
+
+            self.current_text_color = QtGui.QColor(style.color)
+            self.text_color.setStyleSheet(f'background-color: {style.color}'
+                                          if self.current_text_color != QtGui.QColor('black')
+                                          else 'background-color: none')
 
-            self.toggle_bold()
-            self.toggle_italic()
-            self.toggle_underlined()
-        conn.close()
+            self.begin_format_batch()
+            self.merge_format_on_word_or_selection(style_cache.char_format(style_name))
+            self.merge_block_format(style_cache.block_format(style_name))
+            self.end_format_batch()
+
+    def update_format_buttons(self):
+        self.bold.setStyleSheet('background-color: lightblue' if self.bold_active else 'background-color: none')
+        self.italic.setStyleSheet('background-color: lightblue' if self.italic_active else 'background-color: none')
+        self.underlined.setStyleSheet('background-color: lightblue' if self.underlined_active
+                                      else 'background-color: none')
 
     def change_text_color(self):
         color = QColorDialog.getColor()
@@ -291,12 +563,21 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
                                           else 'background-color: none')
 
     def merge_format_on_word_or_selection(self, format):
+        if self.format_batch is not None:
+            self.format_batch.char_format.merge(format)
+            return
         cursor = self.text_edit.textCursor()
         if not cursor.hasSelection():
             cursor.select(QTextCursor.WordUnderCursor)
         cursor.mergeCharFormat(format)
         self.text_edit.mergeCurrentCharFormat(format)
 
+    def merge_block_format(self, block_format):
+        if self.format_batch is not None:
+            self.format_batch.block_format.merge(block_format)
+            return
+        self.text_edit.textCursor().mergeBlockFormat(block_format)
+
     def update_current_format(self):
         format = self.text_edit.currentCharFormat()
         format.setFontWeight(QtGui.QFont.Bold if self.bold_active else QtGui.QFont.Normal)
@@ -312,38 +593,29 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
             try:
                 cursor = self.text_edit.textCursor()
                 image_format = QTextImageFormat()
-                image_format.setName(file_name)
 
-                pixmap = QPixmap(file_name)
-                if pixmap.isNull():
+                # Для размеров по умолчанию достаточно заголовка файла, декодировать всё изображение не нужно
+                size = image_cache.image_size(file_name)
+                if size is None:
                     raise ValueError("Изображение не может быть загружено.")
 
-                default_width = pixmap.width()
-                default_height = pixmap.height()
+                default_width = size.width()
+                default_height = size.height()
                 width, ok = QInputDialog.getInt(self, "Ширина изображения", "Введите ширину:", default_width, 1, 3000)
                 if ok:
                     height, ok = QInputDialog.getInt(self, "Высота изображения", "Введите высоту:",
                                                      default_height, 1, 3000)
                     if ok:
+                        # Документ сам запросит копию в размере на странице: до конца фонового
+                        # декодирования на месте изображения показывается заглушка
+                        image_format.setName(image_cache.resource_name(file_name, width, height))
                         image_format.setWidth(width)
                         image_format.setHeight(height)
+                        # Вставка и восстановление формата - один шаг отмены
+                        cursor.beginEditBlock()
                         cursor.insertImage(image_format)
-                        self.update_font()
-                        self.update_line_spacing()
-                        self.update_font_size()
-
-                        self.bold_active = not self.bold_active
-                        self.italic_active = not self.italic_active
-                        self.underlined_active = not self.underlined_active
-
-                        self.toggle_bold()
-                        self.toggle_italic()
-                        self.toggle_underlined()
-
-                        self.current_text_color = self.current_text_color
-                        format = QtGui.QTextCharFormat()
-                        format.setForeground(self.current_text_color)
-                        self.merge_format_on_word_or_selection(format)
+                        self.reapply_toolbar_format()
+                        cursor.endEditBlock()
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Не удалось вставить изображение: {str(e)}")
 
@@ -355,26 +627,13 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
             if ok2 and url:
                 cursor = self.text_edit.textCursor()
 
+                cursor.beginEditBlock()
                 cursor.insertHtml(f'<a href="{url}">{link_text}</a> ')
 
                 self.text_edit.setTextCursor(cursor)
 
-                self.update_font()
-                self.update_line_spacing()
-                self.update_font_size()
-
-                self.bold_active = not self.bold_active
-                self.italic_active = not self.italic_active
-                self.underlined_active = not self.underlined_active
-
-                self.toggle_bold()
-                self.toggle_italic()
-                self.toggle_underlined()
-
-                self.current_text_color = self.current_text_color
-                format = QtGui.QTextCharFormat()
-                format.setForeground(self.current_text_color)
-                self.merge_format_on_word_or_selection(format)
+                self.reapply_toolbar_format()
+                cursor.endEditBlock()
 
     def update_open_link(self):
         cursor = self.text_edit.textCursor()
@@ -394,6 +653,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
         reply = QMessageBox.question(self, 'Переход по ссылке', f'Хотите перейти по ссылке: {url}?',
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
+            import webbrowser
             webbrowser.open(QUrl(url).toString())
 
     def is_link_selected(self, cursor):
@@ -449,6 +709,10 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
         except ValueError:
             return
 
+        if self.format_batch is not None:
+            self.format_batch.block_format.setLineHeight(spacing * 100, QtGui.QTextBlockFormat.ProportionalHeight)
+            return
+
         cursor = self.text_edit.textCursor()
         block_format = cursor.blockFormat()
         block_format.setLineHeight(spacing * 100, QtGui.QTextBlockFormat.ProportionalHeight)
@@ -469,29 +733,43 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
         self.text_edit.setTextCursor(cursor)
 
     def set_page_margins(self):
-        page_format = QTextFrameFormat()
-        page_format.setLeftMargin(50)
-        page_format.setRightMargin(50)
-        page_format.setTopMargin(50)
-        page_format.setBottomMargin(50)
-        self.text_edit.document().rootFrame().setFrameFormat(page_format)
+        self.apply_page_margins(self.text_edit.document())
+
+    def apply_page_margins(self, document):
+        exporter.apply_page_margins(document)
+
+    def go_to_page(self, page):
+        if page > self.pages.maximum():
+            self.pages.setMaximum(page)
+        self.pages.setValue(page)
 
     def change_page(self):
-        self.page_contents[self.current_page] = self.text_edit.toHtml()
+        self.apply_pending_format()
         self.current_page = self.pages.value()
-
-        self.ignore_text_change = True  # Устанавливаем флаг
         self.load_page_content()
-        self.ignore_text_change = False  # Сбрасываем флаг
 
     def load_page_content(self):
-        text = self.page_contents.get(self.current_page, "")
-        self.text_edit.setHtml(text)
-        self.set_page_margins()
-        self.text_edit.document().setModified(False)
+        # Страница подставляется в редактор как готовый QTextDocument, без круга toHtml()/setHtml()
+        document = self.page_contents.document(self.current_page)
+        self.page_contents.pin(self.current_page)
+
+        if self.connected_document is not None and self.connected_document is not document:
+            try:
+                self.connected_document.contentsChange.disconnect(self.on_text_changed)
+            except (TypeError, RuntimeError):
+                pass
+        self.ignore_text_change = True
+        self.text_edit.setDocument(document)
+        self.ignore_text_change = False
+        if self.connected_document is not document:
+            document.contentsChange.connect(self.on_text_changed)
+            self.connected_document = document
+
+        # Соседние страницы готовятся заранее, чтобы листание не ждало разбора HTML
+        self.page_contents.prefetch([self.current_page + 1, self.current_page - 1], self.text_edit.viewport().width())
 
     def closeEvent(self, event):
-        if self.text_edit.document().isModified():
+        if self.page_contents.is_modified():
             unsaved_warning_message = ("У вас есть несохраненные данные. Они будут утеряны при закрытии программы. "
                                        "Хотите сохранить изменения?")
             message_box = QMessageBox()
@@ -506,60 +784,262 @@ class MainWindow(QtWidgets.QMainWindow, Ui_color):
 
             if message_box.clickedButton() == save_button:
                 self.save_document()
+                self.wait_for_export()
+                # Результат сохранения уже обработан: если оно не состоялось, документ снова помечен изменённым,
+                # и правки останутся в журнале до следующего запуска
+                self.autosave.close(keep=self.page_contents.is_modified())
                 event.accept()
             elif message_box.clickedButton() == discard_button:
+                self.wait_for_export()
+                self.autosave.close(keep=False)
                 event.accept()
             else:
                 event.ignore()
         else:
+            self.wait_for_export()
+            self.autosave.close(keep=False)
             event.accept()
 
 
+# Обработчики главного окна, которые замеряются при TEXT_PROCESSOR_PROFILE=1.
+# Методы с модальными диалогами (выбор файла, цвета) не включены: их время - это время пользователя.
+PROFILED_HANDLERS = (
+    'on_text_changed', 'apply_pending_format', 'current_char_format', 'apply_formats', 'reapply_toolbar_format',
+    'apply_style', 'update_format_buttons', 'merge_format_on_word_or_selection', 'update_current_format',
+    'update_open_link', 'update_font', 'update_font_size', 'apply_font', 'apply_font_size', 'toggle_bold',
+    'toggle_italic', 'toggle_underlined', 'update_line_spacing', 'update_indent', 'set_page_margins', 'change_page',
+    'load_page_content',
+)
+
+if instrumentation.ENABLED:
+    instrumentation.count_serializations(instrumentation.profiler)
+    instrumentation.instrument(MainWindow, PROFILED_HANDLERS, instrumentation.profiler)
+
+
 class SearchWindow(QtWidgets.QWidget, Ui_QtSearchWindow):
-    def __init__(self, text_edit):
+    def __init__(self, text_edit, main_window):
         super().__init__()
         self.text_edit = text_edit
+        self.main_window = main_window
         self.setupUi(self)
         self.setWindowTitle("Поиск")
         self.pushButton_search.clicked.connect(self.perform_search)
         self.pushButton_search_2.clicked.connect(self.navigate_to_next)
         self.pushButton_search_3.clicked.connect(self.navigate_to_previous)
         self.found_positions = []
+        self.found_by_page = {}
         self.current_index = -1
 
-    def perform_search(self):
+        # Поиск по мере ввода: запускается после паузы в наборе, предыдущий запрос отменяется
+        self.search_generation = 0
+        self.search_job = None
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.start_incremental_search)
+        self.lineEdit_search.textChanged.connect(self.schedule_incremental_search)
+        self.checkBox_register.toggled.connect(self.schedule_incremental_search)
+        self.checkBox_entirely.toggled.connect(self.schedule_incremental_search)
+        self.main_window.pages.valueChanged.connect(self.refresh_extra_selections)
+
+        # Подсвечиваются только вхождения в видимой части страницы: список пересобирается при прокрутке,
+        # а текущее вхождение - отдельное выделение поверх, курсор пользователя не трогается
+        self.extra_selections = []
+        self.current_selection = None
+        self.current_selection_page = None
+        # Начала вхождений по страницам для двоичного поиска и видимый диапазон, для которого построена подсветка
+        self.found_starts = {}
+        self.highlighted_range = None
+        scroll_bar = self.text_edit.verticalScrollBar()
+        scroll_bar.valueChanged.connect(self.on_viewport_changed)
+        scroll_bar.rangeChanged.connect(self.on_viewport_changed)
+
+        # Пачки результатов копятся и передаются редактору не чаще раза в HIGHLIGHT_UPDATE_MS
+        self.highlight_timer = QtCore.QTimer(self)
+        self.highlight_timer.setSingleShot(True)
+        self.highlight_timer.setInterval(HIGHLIGHT_UPDATE_MS)
+        self.highlight_timer.timeout.connect(self.refresh_extra_selections)
+
+    def schedule_incremental_search(self):
+        self.cancel_search_job()
+        self.search_timer.start()
+
+    def cancel_search_job(self):
+        self.search_generation += 1
+        if self.search_job is not None:
+            self.search_job.cancel()
+            self.search_job = None
+
+    def start_incremental_search(self):
+        self.cancel_search_job()
+        self.found_positions = []
+        self.found_by_page = {}
+        self.found_starts = {}
+        self.current_index = -1
+        self.extra_selections = []
+        self.current_selection = None
+        self.apply_extra_selections()
+
         search_text = self.lineEdit_search.text()
-        flags = re.IGNORECASE if not self.checkBox_register.isChecked() else 0
-        pattern = re.escape(search_text) if not self.checkBox_entirely.isChecked() else r'\b' + re.escape(search_text) + r'\b'
+        if not search_text:
+            self.setWindowTitle("Поиск")
+            return
 
-        text = self.text_edit.toPlainText()
-        self.found_positions = [m.start() for m in re.finditer(pattern, text, flags)]
+        page = self.main_window.current_page
+        text = self.main_window.search_index.page_text(page).text()
+        regex = replace_engine.build_pattern(search_text, self.checkBox_register.isChecked(),
+                                             self.checkBox_entirely.isChecked())
+
+        self.search_job = SearchJob(self.search_generation, page, text, regex)
+        self.search_job.signals.batch_found.connect(self.on_search_batch)
+        self.search_job.signals.search_finished.connect(self.on_search_finished)
+        QtCore.QThreadPool.globalInstance().start(self.search_job)
+
+    def on_search_batch(self, generation, page, spans):
+        if generation != self.search_generation or page != self.main_window.current_page:
+            return
+        self.found_positions.extend((page, start, end) for start, end in spans)
+        self.found_by_page.setdefault(page, []).extend(spans)
+        self.found_starts.pop(page, None)
+        if not self.highlight_timer.isActive():
+            self.highlight_timer.start()
+        self.setWindowTitle(f"Поиск - найдено: {len(self.found_positions)}")
+
+    def on_search_finished(self, generation):
+        if generation != self.search_generation:
+            return
+        self.search_job = None
+        self.refresh_extra_selections()
+        if not self.found_positions:
+            self.setWindowTitle("Поиск - не найдено")
+
+    def make_selection(self, start, end, color):
+        selection = QtWidgets.QTextEdit.ExtraSelection()
+        selection.cursor = QTextCursor(self.text_edit.document())
+        selection.cursor.setPosition(start)
+        selection.cursor.setPosition(end, QTextCursor.KeepAnchor)
+        selection.format.setBackground(color)
+        return selection
+
+    def make_extra_selections(self, spans):
+        color = QtGui.QColor(SEARCH_HIGHLIGHT_COLOR)
+        return [self.make_selection(start, end, color) for start, end in spans]
+
+    def visible_range(self):
+        """Позиции документа, видимые в области просмотра, с точностью до абзаца."""
+        top = self.text_edit.verticalScrollBar().value()
+        first = self.block_at(top)
+        last = self.block_at(top + self.text_edit.viewport().height())
+        return first.position(), last.position() + last.length()
+
+    def block_at(self, y):
+        """Абзац, на который приходится координата y документа; двоичный поиск по раскладке.
+
+        cursorForPosition() здесь не подходит: в полях страницы он возвращает конец документа.
+        """
+        document = self.text_edit.document()
+        layout = document.documentLayout()
+        low, high = 0, document.blockCount() - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if layout.blockBoundingRect(document.findBlockByNumber(middle)).top() <= y:
+                low = middle
+            else:
+                high = middle - 1
+        return document.findBlockByNumber(low)
+
+    def visible_spans(self, page, first, last):
+        """Вхождения страницы, начинающиеся в диапазоне позиций; вхождения отсортированы по началу."""
+        spans = self.found_by_page.get(page)
+        if not spans:
+            return []
+        starts = self.found_starts.get(page)
+        if starts is None:
+            starts = self.found_starts[page] = [start for start, _ in spans]
+        # Предыдущее вхождение может начинаться выше видимой части и заканчиваться в ней
+        low = max(0, bisect.bisect_left(starts, first) - 1)
+        high = bisect.bisect_right(starts, last)
+        return spans[low:high]
+
+    def apply_extra_selections(self):
+        self.highlight_timer.stop()
+        selections = self.extra_selections
+        if self.current_selection is not None and self.current_selection_page == self.main_window.current_page:
+            selections = selections + [self.current_selection]
+        self.text_edit.setExtraSelections(selections)
+
+    def refresh_extra_selections(self):
+        self.highlighted_range = None
+        self.update_visible_selections()
+
+    def update_visible_selections(self):
+        """Пересобирает подсветку, только если сменился видимый диапазон абзацев."""
+        page = self.main_window.current_page
+        visible = (page,) + self.visible_range()
+        if visible != self.highlighted_range:
+            self.highlighted_range = visible
+            self.extra_selections = self.make_extra_selections(self.visible_spans(*visible))
+            self.apply_extra_selections()
+
+    def on_viewport_changed(self):
+        if self.found_by_page:
+            self.update_visible_selections()
+
+    def perform_search(self):
+        self.search_timer.stop()
+        self.cancel_search_job()
+        search_text = self.lineEdit_search.text()
+        pages = None if self.checkBox_all_pages.isChecked() else [self.main_window.current_page]
+
+        # Текст страниц и индекс слов берутся из кэша, а не сериализуются при каждом поиске;
+        # страницы не загружаются в редактор, результат сгруппирован по страницам
+        self.found_by_page = self.main_window.search_index.search_by_page(
+            search_text, self.checkBox_register.isChecked(), self.checkBox_entirely.isChecked(), pages
+        ) if search_text else {}
+        self.found_starts = {}
+        self.found_positions = [(page, start, end) for page, spans in self.found_by_page.items()
+                                for start, end in spans]
         count = len(self.found_positions)
+        self.refresh_extra_selections()
 
         if count == 0:
             self.show_message("Не найдено")
             self.current_index = -1
             self.clear_highlight()
         else:
-            self.show_message(f"Найдено: {count} вхождений")
+            self.show_message(f"Найдено: {count} вхождений на {len(self.found_by_page)} стр.")
             self.current_index = 0
             self.highlight_current_word()
 
     def highlight_current_word(self):
-        self.clear_highlight()
+        """Текущее вхождение - отдельным цветом; подсветка остальных вхождений не пересобирается."""
+        if self.current_index < 0 or self.current_index >= len(self.found_positions):
+            self.clear_highlight()
+            return
 
-        if self.current_index >= 0 and self.current_index < len(self.found_positions):
-            cursor = self.text_edit.textCursor()
-            pos = self.found_positions[self.current_index]
-            cursor.setPosition(pos)
-            cursor.movePosition(cursor.Right, cursor.KeepAnchor, len(self.lineEdit_search.text()))
-            self.text_edit.setTextCursor(cursor)
-            self.text_edit.setFocus()
+        page, start, end = self.found_positions[self.current_index]
+        if page != self.main_window.current_page:
+            self.main_window.go_to_page(page)
+        self.current_selection = self.make_selection(start, end, QtGui.QColor(CURRENT_MATCH_COLOR))
+        self.current_selection_page = page
+        self.apply_extra_selections()
+        # Прокрутка сама обновит подсветку видимых вхождений через on_viewport_changed
+        self.scroll_to(start)
+
+    def scroll_to(self, position):
+        """Прокручивает так, чтобы позиция была видна, не сдвигая курсор пользователя."""
+        cursor = QTextCursor(self.text_edit.document())
+        cursor.setPosition(position)
+        rect = self.text_edit.cursorRect(cursor)
+        viewport = self.text_edit.viewport().rect()
+        if not viewport.contains(rect):
+            scroll_bar = self.text_edit.verticalScrollBar()
+            scroll_bar.setValue(scroll_bar.value() + rect.center().y() - viewport.height() // 2)
 
     def clear_highlight(self):
-        cursor = self.text_edit.textCursor()
-        cursor.clearSelection()
-        self.text_edit.setTextCursor(cursor)
+        self.current_selection = None
+        self.current_selection_page = None
+        self.apply_extra_selections()
 
     def show_message(self, message):
         msg_box = QMessageBox()
@@ -582,16 +1062,28 @@ class SearchWindow(QtWidgets.QWidget, Ui_QtSearchWindow):
         self.lineEdit_search.clear()
         self.checkBox_entirely.setChecked(False)
         self.checkBox_register.setChecked(False)
+        self.checkBox_all_pages.setChecked(False)
+        self.search_timer.stop()
+        self.cancel_search_job()
+        self.found_positions = []
+        self.found_by_page = {}
+        self.found_starts = {}
+        self.extra_selections = []
+        self.current_selection = None
+        self.apply_extra_selections()
+        self.setWindowTitle("Поиск")
         event.accept()
 
 
 class ReplaceWindow(QtWidgets.QWidget, Ui_QtReplaceWindow):
-    def __init__(self, text_edit):
+    def __init__(self, text_edit, main_window):
         super().__init__()
         self.text_edit = text_edit
+        self.main_window = main_window
         self.setupUi(self)
         self.setWindowTitle("Заменить")
         self.pushButton_replace.clicked.connect(self.replace_all)
+        self.pushButton_rules.clicked.connect(self.replace_by_rules)
 
     def replace_all(self):
         word_to_replace = self.lineEdit_search2.text()
@@ -601,37 +1093,72 @@ class ReplaceWindow(QtWidgets.QWidget, Ui_QtReplaceWindow):
             self.show_message("Пожалуйста, введите слово для замены.")
             return
 
-        flags = re.IGNORECASE if not self.checkBox_register.isChecked() else 0
-        pattern = re.escape(word_to_replace) if not self.checkBox_entirely.isChecked() else r'\b' + re.escape(word_to_replace) + r'\b'
-
-        cursor = self.text_edit.textCursor()
-        cursor.beginEditBlock()
-
-        regex = re.compile(pattern, flags)
-        pos = 0
-        while True:
-            match = regex.search(self.text_edit.toPlainText(), pos)
-            if not match:
-                break
+        use_regex = self.checkBox_regex.isChecked()
+        try:
+            regex = replace_engine.build_pattern(word_to_replace, self.checkBox_register.isChecked(),
+                                                 self.checkBox_entirely.isChecked(), use_regex)
+        except re.error as error:
+            self.show_message(f"Ошибка в регулярном выражении: {error}")
+            return
 
-            start, end = match.span()
-            cursor.setPosition(start)
-            cursor.movePosition(QtGui.QTextCursor.Right, QtGui.QTextCursor.KeepAnchor, end - start)
+        if use_regex:
+            # Замена может ссылаться на группы (\1, \g<name>), поэтому идёт через пакетную замену
+            result = self.substitute([(regex, replacement_word)])
+            if result is None:
+                return
+        else:
+            # Заменённые участки сохраняют свой формат, поэтому переформатирование ввода здесь не нужно
+            self.main_window.ignore_text_change = True
+            if self.checkBox_all_pages.isChecked():
+                # Совпадения ищутся по кэшу текста всех страниц, загружаются только страницы с совпадениями
+                hits = self.main_window.search_index.find_pattern(regex)
+                result = replace_engine.replace_in_pages(self.main_window.page_contents, hits, replacement_word)
+            else:
+                result = replace_engine.replace_all(self.text_edit.document(), regex, replacement_word)
+            self.main_window.ignore_text_change = False
 
-            current_format = cursor.charFormat()
-            cursor.insertText(replacement_word)
-            cursor.setPosition(start)
-            cursor.movePosition(QtGui.QTextCursor.Right, QtGui.QTextCursor.KeepAnchor, len(replacement_word))
-            cursor.mergeCharFormat(current_format)
+        self.main_window.set_page_margins()
 
-            pos = start + len(replacement_word)
+        self.show_message(f"Все вхождения '{word_to_replace}' заменены на '{replacement_word}'.\n"
+                          f"Замен: {result.count} на {result.pages} стр., время: {result.elapsed:.3f} с.")
+        self.close()
 
-        cursor.endEditBlock()
+    def replace_by_rules(self):
+        """Пакетная замена по правилам из JSON-файла (см. replace_engine.load_rules)."""
+        file_path, _ = QFileDialog.getOpenFileName(self, "Правила замены", "", "Правила (*.json)")
+        if not file_path:
+            return
+        try:
+            rules = replace_engine.load_rules(file_path)
+        except (OSError, ValueError) as error:
+            self.show_message(f"Не удалось прочитать правила: {error}")
+            return
 
-        main_window.set_page_margins()
+        result = self.substitute(rules)
+        if result is None:
+            return
+        self.main_window.set_page_margins()
+        self.show_message(f"Правил: {len(rules)}, замен: {result.count} на {result.pages} стр., "
+                          f"время: {result.elapsed:.3f} с.")
+
+    def substitute(self, rules):
+        """Правила по текущей странице или по всем страницам; None, если в шаблоне замены ошибка."""
+        main_window = self.main_window
+        if self.checkBox_all_pages.isChecked():
+            pages = main_window.page_contents.keys()
+        else:
+            pages = [main_window.current_page]
+        # Плоский текст страниц берётся из кэша индекса поиска, документы загружаются только для изменяемых страниц
+        texts = [(page, main_window.search_index.page_text(page).text()) for page in pages]
 
-        self.show_message(f"Все вхождения '{word_to_replace}' заменены на '{replacement_word}'.")
-        self.close()
+        main_window.ignore_text_change = True
+        try:
+            return replace_engine.substitute_in_pages(main_window.page_contents, texts, rules)
+        except re.error as error:
+            self.show_message(f"Ошибка в шаблоне замены: {error}")
+            return None
+        finally:
+            main_window.ignore_text_change = False
 
     def show_message(self, message):
         msg_box = QMessageBox()
@@ -643,6 +1170,8 @@ class ReplaceWindow(QtWidgets.QWidget, Ui_QtReplaceWindow):
         self.lineEdit_search2.clear()
         self.checkBox_entirely.setChecked(False)
         self.checkBox_register.setChecked(False)
+        self.checkBox_all_pages.setChecked(False)
+        self.checkBox_regex.setChecked(False)
         event.accept()
 
 
@@ -654,49 +1183,28 @@ class StyleWindow(QtWidgets.QWidget, Ui_Form):
         self.setupUi(self)
         self.setWindowTitle("Стили")
 
-        self.new_style_window = NewStyleWindow()
+        self.new_style_window = None
         self.new_style.clicked.connect(self.open_new_style_window)
 
-        self.conn = sqlite3.connect('text_processor.db')
-        self.cur = self.conn.cursor()
-
-        self.radio_container = QWidget()
-        self.radio_layout = QVBoxLayout(self.radio_container)
-        self.scrollArea.setWidget(self.radio_container)
+        # Список строится по модели из кэша стилей: новые стили добавляются строкой, без перестройки
+        self.style_list = QtWidgets.QListView()
+        self.style_list.setModel(StyleListModel(get_style_cache(), self))
+        self.style_list.setUniformItemSizes(True)
+        self.style_list.doubleClicked.connect(self.save_style)
+        self.scrollArea.setWidget(self.style_list)
 
         self.scrollArea.setWidgetResizable(True)
         self.save.clicked.connect(self.save_style)
 
     def save_style(self):
-        selected_style = None
-        for i in range(self.radio_layout.count()):
-            radio_button = self.radio_layout.itemAt(i).widget()
-            if radio_button and radio_button.isChecked():
-                selected_style = radio_button.text()
-                break
-
-        if selected_style:
-            self.style_selected.emit(selected_style)
+        index = self.style_list.currentIndex()
+        if index.isValid():
+            self.style_selected.emit(index.data())
             self.close()
 
-    def showEvent(self, event):
-        self.update_scroll_area()
-        super().showEvent(event)
-
-    def update_scroll_area(self):
-        for i in reversed(range(self.radio_layout.count())):
-            widget = self.radio_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.deleteLater()
-
-        self.cur.execute("SELECT name FROM styles")
-        styles = self.cur.fetchall()
-
-        for style in styles:
-            radio_button = QRadioButton(style[0])
-            self.radio_layout.addWidget(radio_button)
-
     def open_new_style_window(self):
+        if self.new_style_window is None:
+            self.new_style_window = NewStyleWindow()
         self.new_style_window.show()
         self.close()
 
@@ -864,15 +1372,9 @@ class NewStyleWindow(QtWidgets.QWidget, Ui_QtNewStyleWindow):
         msg_box.exec_()
 
     def add_row(self, name, shrift, pt, bold, italic, underlined, interval, color):
-        self.conn = sqlite3.connect("text_processor.db")
         if name != '':
             try:
-                cur = self.conn.cursor()
-                a = f"""INSERT INTO styles(name, shrift, pt, bold, italic, underlined, interval, color) 
-                VALUES("{name}", "{shrift}", "{pt}", "{bold}", "{italic}", "{underlined}", "{interval}", "{color}" )"""
-                cur.execute(a)
-                self.conn.commit()
-                cur.close()
+                get_style_cache().add_style(name, shrift, pt, bold, italic, underlined, interval, color)
 
                 self.show_message("Успешное добавление стиля")
 
@@ -908,16 +1410,13 @@ class NewStyleWindow(QtWidgets.QWidget, Ui_QtNewStyleWindow):
 
 # вот это все написано чатом гпт реально
 
-import sys
-import time
 import threading
-import requests
-import webbrowser
+
 
 class PaymentWindow(QtWidgets.QMainWindow):
     update_text = QtCore.pyqtSignal(str)
 
-    def __init__(self, amount):
+    def __init__(self, amount, base_url=None):
         super().__init__()
         self.setWindowTitle("Оплата через YooKassa")
         self.setFixedSize(440, 220)
@@ -930,102 +1429,102 @@ class PaymentWindow(QtWidgets.QMainWindow):
 
         self.payment_id = None
         self.amount = amount
+        # requests загружается только здесь: редактору при запуске он не нужен
+        from payment_client import PaymentClient
+        self.client = PaymentClient(base_url)
 
         # Создаём платёж и запускаем проверку
         threading.Thread(target=self.start_payment_flow, daemon=True).start()
 
     def start_payment_flow(self):
-        """Создаёт платёж на сервере, открывает ссылку и запускает polling."""
-        try:
-            # 1) Создаём платёж на сервере
-            # ожидаем, что endpoint /paying/{amount} возвращает JSON:
-            # {"payment_url": "...", "payment_id": "..."}
-            resp = requests.get(f"http://localhost:8000/paying/{self.amount}", timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
+        """Создаёт платёж на сервере, открывает ссылку и ждёт подтверждения."""
+        import webbrowser
+        import requests
+        from payment_client import PaymentCancelled
 
-            payment_url = data.get("payment_url")
-            payment_id = data.get("payment_id")
+        try:
+            payment_url, payment_id = self.client.create_payment(self.amount)
 
             if not payment_url or not payment_id:
-                self.update_text.emit("Ошибка: сервер вернул некорректный ответ при создании платежа.")
+                self.show_status("Ошибка: сервер вернул некорректный ответ при создании платежа.")
                 return
 
             self.payment_id = payment_id
 
-            # 2) Открываем confirmation URL в браузере
             try:
                 webbrowser.open(payment_url)
             except Exception as e:
-                self.update_text.emit(f"Ошибка при переходе в системный браузер:\n{e}")
+                self.show_status(f"Ошибка при переходе в системный браузер:\n{e}")
 
-            # 3) Запускаем polling статуса (в этом же потоке)
             self._poll_payment_status()
 
+        except PaymentCancelled:
+            pass
         except requests.RequestException as e:
-            self.update_text.emit(f"Ошибка при создании платежа:\n{e}")
+            self.show_status(f"Ошибка при создании платежа:\n{e}")
         except Exception as e:
-            self.update_text.emit(f"Неизвестная ошибка:\n{e}")
+            self.show_status(f"Неизвестная ошибка:\n{e}")
 
     def _poll_payment_status(self):
-        """Проверяет /payment_status/{payment_id} каждые 5 сек в течение 10 минут."""
+        """Ждёт окончательного статуса платежа (не дольше 10 минут)."""
+        from payment_client import PaymentCancelled, SUCCEEDED, CANCELED, NOT_FOUND
+
         if not self.payment_id:
             return
 
-        interval = 5
-        timeout = 600  # 10 минут
-        start = time.time()
+        self.show_status("Платёж создан. Ожидание подтверждения...")
+
+        try:
+            result = self.client.wait_for_payment(self.payment_id, self.on_payment_progress)
+        except PaymentCancelled:
+            return
+        except Exception as e:
+            self.show_status(f"Ошибка проверки платежа: {e}")
+            return
+
+        if result == SUCCEEDED:
+            self.show_status("✅ Оплата прошла успешно!")
+        elif result == CANCELED:
+            self.show_status("❌ Платёж отменён или истёк.")
+        elif result == NOT_FOUND:
+            self.show_status("Платёж не найден на сервере.")
+        else:
+            self.show_status("⏰ Время ожидания оплаты истекло.")
 
-        self.update_text.emit("Платёж создан. Ожидание подтверждения...")
+    def on_payment_progress(self, status, error):
+        import requests
 
-        while time.time() - start < timeout:
-            try:
-                resp = requests.get(f"http://localhost:8000/payment_status/{self.payment_id}", timeout=10)
-                # Ожидаем, что endpoint возвращает либо {"status": "..."} либо {"status": "...", "paid": true}
-                if resp.status_code == 200:
-                    js = resp.json()
-                    status = js.get("status")
-                    paid = js.get("paid")  # опционально, если сервер отдаёт булево
-
-                    # явная проверка статуса
-                    if status == "succeeded" or paid is True:
-                        self.update_text.emit("✅ Оплата прошла успешно!")
-                        return
-                    if status in ("canceled", "expired", "failed") or paid is False and status in (
-                    "canceled", "expired", "failed"):
-                        self.update_text.emit("❌ Платёж отменён или истёк.")
-                        return
-
-                    # иначе — ещё ждём
-                    self.update_text.emit(f"Ожидание оплаты... (статус: {status})")
-
-                elif resp.status_code == 404:
-                    self.update_text.emit("Платёж не найден на сервере.")
-                    return
-                else:
-                    # временная проблема - показываем краткое сообщение и продолжаем
-                    self.update_text.emit(f"Ожидание ответа... (код {resp.status_code})")
-
-            except requests.RequestException as e:
-                # сеть упала или сервер недоступен — показываем, но продолжаем попытки
-                self.update_text.emit(f"Ошибка связи с сервером, повтор через {interval}s...")
-            except Exception as e:
-                self.update_text.emit(f"Ошибка проверки платежа: {e}")
-                return
+        if isinstance(error, requests.RequestException):
+            self.show_status("Ошибка связи с сервером, повторная попытка...")
+        elif error is not None:
+            self.show_status(f"Ожидание ответа... ({error})")
+        else:
+            self.show_status(f"Ожидание оплаты... (статус: {status})")
 
-            time.sleep(interval)
+    def show_status(self, text):
+        # После закрытия окна поток ещё может вернуться из запроса - сообщения уже некому показывать
+        if not self.client.cancelled:
+            self.update_text.emit(text)
 
-        # время вышло
-        self.update_text.emit("⏰ Время ожидания оплаты истекло.")
+    def closeEvent(self, event):
+        self.client.cancel()
+        event.accept()
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['convert']:
+        # python main.py convert ... - пакетное преобразование без окна
+        import batch_convert
+        sys.exit(batch_convert.run_cli(sys.argv[2:]))
+
     app = QtWidgets.QApplication(sys.argv)
     window = PaymentWindow(500)
+    startup_timing.report_on_first_paint(window)
     window.show()
     sys.exit(app.exec())
 
     # main_window = MainWindow()
+    # startup_timing.report_on_first_paint(main_window)
     # main_window.show()
     # sys.exit(app.exec_())
 
@@ -0,0 +1,263 @@
+"""Собственный двоичный формат документа (*.tpd).
+
+Файл: заголовок, секции страниц и в конце - индекс (смещение, длина)
+каждой секции, поэтому страница читается без разбора остальных.
+Секция - байт вида и сжатые zlib данные. Страница из абзацев хранит
+таблицу форматов документа (QDataStream), для каждого абзаца - номера
+его форматов и отрезки (номер формата символов, длина в символах),
+и затем весь текст страницы подряд в UTF-8. Документ собирается из этого через QTextCursor,
+без HTML-парсера. Страницы со списками, таблицами и вложенными фреймами
+хранятся в секции как HTML.
+"""
+import contextlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from PyQt5 import QtCore
+from PyQt5.QtGui import QTextCursor, QTextDocument, QTextFormat
+
+from exporter import report_progress
+
+EXTENSION = '.tpd'
+MAGIC = b'TPD\x00'
+VERSION = 1
+# magic, версия, число страниц, смещение индекса
+HEADER = struct.Struct('<4sHxxIQ')
+INDEX_ENTRY = struct.Struct('<QI')
+# число форматов, размер их блока, число абзацев, число целых в таблице абзацев
+SECTION_HEADER = struct.Struct('<IIII')
+SECTION_BLOCKS = 0
+SECTION_HTML = 1
+# Скорость записи важнее размера: сохранение идёт при каждом нажатии "Сохранить"
+COMPRESSION_LEVEL = 1
+STREAM_VERSION = QtCore.QDataStream.Qt_5_12
+
+
+def is_native_file(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _little_endian(ints):
+    if sys.byteorder == 'big':
+        ints.byteswap()
+    return ints
+
+
+def has_plain_layout(document):
+    """Страница состоит только из абзацев: без таблиц, вложенных фреймов и списков."""
+    if document.rootFrame().childFrames():
+        return False
+    block = document.begin()
+    while block.isValid():
+        if block.textList() is not None:
+            return False
+        block = block.next()
+    return True
+
+
+def document_payload(document):
+    """(вид секции, несжатые данные) страницы; вызывается в потоке, которому принадлежит документ."""
+    if not has_plain_layout(document):
+        return SECTION_HTML, document.toHtml().encode('utf-8')
+
+    formats = document.allFormats()
+    formats_data = QtCore.QByteArray()
+    stream = QtCore.QDataStream(formats_data, QtCore.QIODevice.WriteOnly)
+    stream.setVersion(STREAM_VERSION)
+    for text_format in formats:
+        stream << text_format
+
+    ints = array('I')
+    texts = []
+    block_count = 0
+    block = document.begin()
+    while block.isValid():
+        runs = array('I')
+        iterator = block.begin()
+        while not iterator.atEnd():
+            fragment = iterator.fragment()
+            text = fragment.text()
+            runs.append(fragment.charFormatIndex())
+            runs.append(len(text))
+            texts.append(text)
+            iterator += 1
+        ints.extend((block.blockFormatIndex(), block.charFormatIndex(), len(runs) // 2))
+        ints.extend(runs)
+        block_count += 1
+        block = block.next()
+
+    payload = b''.join((SECTION_HEADER.pack(len(formats), formats_data.size(), block_count, len(ints)),
+                        bytes(formats_data), _little_endian(ints).tobytes(), ''.join(texts).encode('utf-8')))
+    return SECTION_BLOCKS, payload
+
+
+def pack_section(kind, payload):
+    """Сжатие отдельно от document_payload(), чтобы его можно было вынести из потока интерфейса."""
+    return bytes((kind,)) + zlib.compress(payload, COMPRESSION_LEVEL)
+
+
+def encode_document(document):
+    return pack_section(*document_payload(document))
+
+
+def html_to_section(html):
+    """Секция из HTML; документ создаётся в вызывающем потоке и нигде больше не используется."""
+    document = QTextDocument()
+    document.setHtml(html)
+    return encode_document(document)
+
+
+def decode_section(data):
+    """NativePage или HTML-строка; чистый Python, можно вызывать в любом потоке."""
+    payload = zlib.decompress(data[1:])
+    if data[0] == SECTION_HTML:
+        return payload.decode('utf-8')
+    return NativePage(payload)
+
+
+class NativePage:
+    """Разобранная секция страницы, готовая к сборке в QTextDocument.
+
+    ints - для каждого абзаца номер формата абзаца, номер формата символов
+    абзаца, число отрезков и пары (номер формата, длина); text - весь текст.
+    """
+    __slots__ = ('formats', 'block_count', 'ints', 'text')
+
+    def __init__(self, payload):
+        format_count, formats_size, block_count, int_count = SECTION_HEADER.unpack_from(payload)
+        offset = SECTION_HEADER.size
+
+        stream = QtCore.QDataStream(QtCore.QByteArray(payload[offset:offset + formats_size]))
+        stream.setVersion(STREAM_VERSION)
+        self.formats = []
+        for _ in range(format_count):
+            text_format = QTextFormat()
+            stream >> text_format
+            self.formats.append(text_format)
+        offset += formats_size
+
+        self.block_count = block_count
+        self.ints = array('I')
+        self.ints.frombytes(payload[offset:offset + int_count * self.ints.itemsize])
+        _little_endian(self.ints)
+        offset += int_count * self.ints.itemsize
+        self.text = payload[offset:].decode('utf-8')
+
+    def iter_blocks(self):
+        """(номер формата абзаца, номер формата символов абзаца, [(номер формата, начало, конец)])."""
+        ints = self.ints
+        position = 0
+        offset = 0
+        for _ in range(self.block_count):
+            block_format, char_format, run_count = ints[position:position + 3]
+            position += 3
+            runs = []
+            for _ in range(run_count):
+                length = ints[position + 1]
+                runs.append((ints[position], offset, offset + length))
+                offset += length
+                position += 2
+            yield block_format, char_format, runs
+
+    def block_texts(self):
+        return [self.text[runs[0][1]:runs[-1][2]] if runs else "" for _, _, runs in self.iter_blocks()]
+
+    def build(self, document):
+        """Заполняет пустой документ; история отмены при этом не пишется."""
+        char_formats = {}
+        block_formats = {}
+
+        def char_format(index):
+            if index not in char_formats:
+                char_formats[index] = self.formats[index].toCharFormat()
+            return char_formats[index]
+
+        def block_format(index):
+            if index not in block_formats:
+                block_formats[index] = self.formats[index].toBlockFormat()
+            return block_formats[index]
+
+        undo_enabled = document.isUndoRedoEnabled()
+        document.setUndoRedoEnabled(False)
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+        text = self.text
+        for i, (block_index, char_index, runs) in enumerate(self.iter_blocks()):
+            if i:
+                cursor.insertBlock(block_format(block_index), char_format(char_index))
+            else:
+                cursor.setBlockFormat(block_format(block_index))
+                cursor.setBlockCharFormat(char_format(char_index))
+            for run_index, start, end in runs:
+                cursor.insertText(text[start:end], char_format(run_index))
+        cursor.endEditBlock()
+        document.setUndoRedoEnabled(undo_enabled)
+
+
+def section_to_html(data):
+    page = decode_section(data)
+    if isinstance(page, str):
+        return page
+    document = QTextDocument()
+    page.build(document)
+    return document.toHtml()
+
+
+class NativeFile:
+    """Файл *.tpd, отображённый в память; интерфейс тот же, что у document_loader.MappedFile."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            self._mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, page_count, index_offset = HEADER.unpack_from(self._mapping)
+            if magic != MAGIC or version > VERSION:
+                raise ValueError(f"{file_path} - не документ text_processor или создан более новой версией")
+            self.page_ranges = []
+            for i in range(page_count):
+                start, length = INDEX_ENTRY.unpack_from(self._mapping, index_offset + i * INDEX_ENTRY.size)
+                self.page_ranges.append((start, start + length))
+        except Exception:
+            self._file.close()
+            raise
+
+    def section(self, start, end):
+        return self._mapping[start:end]
+
+    def load(self, start, end):
+        return decode_section(self._mapping[start:end])
+
+    def read(self, start, end):
+        return section_to_html(self._mapping[start:end])
+
+
+def export_native(pages, file_path, total=None, progress=None):
+    """Пишет страницы (page, source) в *.tpd; source - готовая секция (bytes) или HTML.
+
+    Как и export_html, пишет во временный файл и подменяет им целевой.
+    """
+    temp_path = file_path + '.tmp'
+    index = []
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+            for done, (page, source) in enumerate(pages):
+                section = source if isinstance(source, bytes) else html_to_section(source)
+                index.append((file.tell(), len(section)))
+                file.write(section)
+                report_progress(progress, done + 1, total)
+            index_offset = file.tell()
+            file.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in index))
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, len(index), index_offset))
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, file_path)
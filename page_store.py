@@ -0,0 +1,451 @@
+import hashlib
+import itertools
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from functools import partial
+
+from PyQt5 import QtCore
+
+from exporter import UNCHANGED
+from image_cache import PageDocument
+from native_format import (NativeFile, NativePage, decode_section, document_payload, encode_document, pack_section,
+                           section_to_html)
+
+# Сколько страниц одновременно держать в памяти в виде живых QTextDocument
+DEFAULT_MAX_CACHED_PAGES = int(os.environ.get('TEXT_PROCESSOR_PAGE_CACHE', 8))
+# Меньше нельзя: страница в редакторе, две соседние и та, на которую переходят, живут одновременно
+MIN_CACHED_PAGES = 4
+SPILL_COMPRESSION_LEVEL = 3
+# Через сколько миллисекунд после перехода на страницу начинать подготовку соседних
+PREFETCH_DELAY_MS = 50
+
+
+class PageStore(QtCore.QObject):
+    """Хранилище страниц документа.
+
+    Недавно открытые страницы живут в памяти как QTextDocument (LRU-окно),
+    остальные выгружаются во временный файл подкачки секциями native_format,
+    а присвоенный HTML - сжатым zlib.
+    Страницы только что открытого файла хранятся как байтовые диапазоны
+    отображённого в память файла (HTML или *.tpd) и разбираются при первом показе.
+    Для совместимости со старым словарём page_contents поддерживает
+    keys(), get(), len(), in и присваивание HTML по номеру страницы.
+
+    page_changed(page, position, removed, added) пересылает contentsChange
+    живых документов; position == -1 означает, что страница заменена целиком.
+
+    Страницы, изменённые с последнего сохранения, помечаются грязными:
+    сохранение забирает их через take_dirty() и не сериализует остальные.
+    page_dirtied(page) приходит на каждую правку страницы.
+
+    prefetch() заранее готовит соседние страницы: их HTML читается и
+    распаковывается в пуле потоков, а разбирается в документ в потоке
+    интерфейса, пока пользователь читает текущую страницу.
+    """
+    page_changed = QtCore.pyqtSignal(int, int, int, int)
+    page_dirtied = QtCore.pyqtSignal(int)
+    pages_cleared = QtCore.pyqtSignal()
+
+    def __init__(self, max_cached_pages=DEFAULT_MAX_CACHED_PAGES, prepare_document=None, parent=None):
+        super().__init__(parent)
+        self.max_cached_pages = max(MIN_CACHED_PAGES, max_cached_pages)
+        self.prepare_document = prepare_document
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.prefetched = 0
+
+        self._documents = OrderedDict()
+        self._spilled = {}
+        self._mapped = {}
+        self._stored_revision = {}
+        self._modified = set()
+        self._dirty = set()
+        # Хэш сохранённой в подкачке копии: выгружаемая страница с тем же текстом не пишется повторно
+        self._digests = {}
+        self._pinned = None
+        self._scratch = None
+
+        # Версия сохранённой копии страницы: прочитанный заранее HTML устаревшей версии отбрасывается
+        self._versions = itertools.count(1)
+        self._source_version = {}
+        self._neighbours = set()
+        self._prefetch_queue = []
+        self._prefetch_width = None
+        self._prefetch_timer = QtCore.QTimer(self)
+        self._prefetch_timer.setSingleShot(True)
+        self._prefetch_timer.setInterval(PREFETCH_DELAY_MS)
+        self._prefetch_timer.timeout.connect(self._start_prefetch)
+
+    def __len__(self):
+        return len(self._page_numbers())
+
+    def __contains__(self, page):
+        return page in self._documents or page in self._spilled or page in self._mapped
+
+    def __setitem__(self, page, html):
+        self.set_html(page, html)
+
+    def keys(self):
+        return sorted(self._page_numbers())
+
+    def get(self, page, default=""):
+        if page not in self:
+            return default
+        return self.html(page)
+
+    def iter_html(self):
+        """Отдаёт (page, html) по одной странице, не держа весь документ в памяти."""
+        for page in self.keys():
+            yield page, self.html(page)
+
+    def snapshot(self, unchanged=(), pages=None, native=False):
+        """Неизменяемый снимок страниц для чтения из другого потока.
+
+        Живые документы сериализуются сейчас (их не больше max_cached_pages),
+        остальные страницы передаются ссылками на файл подкачки или открытый
+        файл: файл подкачки только дописывается, поэтому старые смещения
+        остаются корректными. Страницы из unchanged не читаются вовсе,
+        вместо их HTML в снимке стоит exporter.UNCHANGED. Если задан pages,
+        в снимок попадают только эти страницы. При native живые документы
+        и страницы открытого *.tpd отдаются готовыми секциями native_format.
+        """
+        sources = []
+        for page in self.keys() if pages is None else sorted(page for page in pages if page in self):
+            document = self._documents.get(page)
+            unchanged_document = document is not None and document.revision() == self._stored_revision.get(page)
+            if page in unchanged:
+                sources.append((page, UNCHANGED))
+            elif native and (document is None or unchanged_document) and self._stored_section(page) is not None:
+                sources.append((page, self._stored_section(page)))
+            elif document is not None and native:
+                # Сжатие секции - уже в потоке экспорта
+                sources.append((page, partial(pack_section, *document_payload(document))))
+            elif document is not None:
+                sources.append((page, document.toHtml()))
+            else:
+                sources.append((page, self._stored_reader(page)))
+        return PageSnapshot(sources)
+
+    def dirty_pages(self):
+        return set(self._dirty)
+
+    def take_dirty(self):
+        """Возвращает страницы, изменённые с прошлого вызова, и считает их сохранёнными."""
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def mark_dirty(self, pages):
+        """Возвращает страницы в число изменённых, например, если сохранение не удалось."""
+        self._dirty.update(page for page in pages if page in self)
+
+    def _mark_dirty(self, page):
+        self._dirty.add(page)
+        self.page_dirtied.emit(page)
+
+    def _page_numbers(self):
+        return set(self._documents) | set(self._spilled) | set(self._mapped)
+
+    def pin(self, page):
+        """Страница в редакторе не вытесняется из памяти."""
+        self._pinned = page
+
+    def cached_document(self, page):
+        """Живой документ страницы или None; порядок LRU не меняется."""
+        return self._documents.get(page)
+
+    def document(self, page):
+        if page in self._documents:
+            self.hits += 1
+            self._documents.move_to_end(page)
+            return self._documents[page]
+
+        self.misses += 1
+        stored = page in self._spilled or page in self._mapped
+        return self._create_document(page, self._stored_loader(page)() if stored else None)
+
+    def prefetch(self, pages, text_width=None):
+        """Готовит документы страниц pages заранее; они не вытесняются, пока не будет задан новый список.
+
+        Если задана text_width, документ сразу раскладывается под эту ширину,
+        и подстановка его в редактор не требует новой раскладки.
+        """
+        self._prefetch_width = text_width
+        self._neighbours = {page for page in pages if page in self}
+        self._prefetch_queue = [page for page in pages if page in self._neighbours and page not in self._documents]
+        if self._prefetch_queue:
+            self._prefetch_timer.start()
+        else:
+            self._prefetch_timer.stop()
+
+    def _start_prefetch(self):
+        for page in self._prefetch_queue:
+            if page in self._documents or page not in self._source_version:
+                continue
+            job = PageReadJob(page, self._source_version[page], self._stored_loader(page))
+            job.signals.page_read.connect(self._on_prefetched)
+            QtCore.QThreadPool.globalInstance().start(job)
+        self._prefetch_queue = []
+
+    def _on_prefetched(self, page, version, source):
+        # Пока HTML читался, страница могла быть открыта, заменена или стать не соседней
+        if page in self._documents or page not in self._neighbours or self._source_version.get(page) != version:
+            return
+        document = self._create_document(page, source)
+        if self._prefetch_width:
+            document.setTextWidth(self._prefetch_width)
+            document.size()
+        self.prefetched += 1
+
+    def _create_document(self, page, source):
+        """source - HTML или NativePage из *.tpd, который собирается без разбора HTML."""
+        document = PageDocument(self)
+        if isinstance(source, NativePage):
+            source.build(document)
+        elif source is not None:
+            document.setHtml(source)
+        if self.prepare_document is not None:
+            self.prepare_document(document)
+        document.setModified(page in self._modified)
+        self._stored_revision[page] = document.revision()
+        document.contentsChange.connect(partial(self._on_contents_change, document, page))
+        document.modificationChanged.connect(partial(self._on_modification_changed, page))
+
+        self._documents[page] = document
+        # Созданный документ сейчас же уйдёт в редактор, хотя ещё не закреплён pin()
+        self._evict(keep=page)
+        return document
+
+    def _on_contents_change(self, document, page, position, removed, added):
+        # contentsChange приходит и без правок (например, при setDocument), поэтому страница
+        # грязная, только если документ изменён; первая правка отмечается в _on_modification_changed
+        if document.isModified():
+            self._mark_dirty(page)
+        self.page_changed.emit(page, position, removed, added)
+
+    def _on_modification_changed(self, page, modified):
+        if modified:
+            self._mark_dirty(page)
+
+    def notify_changed(self, page):
+        """Страница изменена в обход редактора: у документа без раскладки Qt не посылает contentsChange."""
+        self.page_changed.emit(page, -1, 0, 0)
+
+    def set_html(self, page, html):
+        """Записывает HTML страницы сразу в файл подкачки, не создавая документ."""
+        document = self._documents.pop(page, None)
+        if document is not None:
+            document.deleteLater()
+        data = html.encode('utf-8')
+        self._write_spilled(page, self._get_scratch(), zlib.compress(data, SPILL_COMPRESSION_LEVEL), page_digest(data))
+        self._stored_revision.pop(page, None)
+        self._mark_dirty(page)
+        self.page_changed.emit(page, -1, 0, 0)
+
+    def set_mapped(self, page, mapped_file, start, end):
+        """Страница - диапазон байт файла; HTML будет прочитан только при обращении."""
+        document = self._documents.pop(page, None)
+        if document is not None:
+            document.deleteLater()
+        self._spilled.pop(page, None)
+        self._mapped[page] = (mapped_file, start, end)
+        self._digests.pop(page, None)
+        self._source_version[page] = next(self._versions)
+        self._stored_revision.pop(page, None)
+        self.page_changed.emit(page, -1, 0, 0)
+
+    def stored_page(self, page):
+        """Сохранённая копия страницы (HTML или NativePage) без создания документа."""
+        if page in self._spilled or page in self._mapped:
+            return self._stored_loader(page)()
+        return ""
+
+    def html(self, page):
+        document = self._documents.get(page)
+        if document is not None:
+            return document.toHtml()
+        if page in self._spilled or page in self._mapped:
+            return self._stored_reader(page)()
+        return ""
+
+    def is_modified(self):
+        return bool(self._modified) or any(document.isModified() for document in self._documents.values())
+
+    def set_modified(self, modified):
+        for document in self._documents.values():
+            document.setModified(modified)
+        self._modified = set(self._page_numbers()) if modified else set()
+
+    def clear(self):
+        for document in self._documents.values():
+            document.deleteLater()
+        self._documents.clear()
+        self._spilled.clear()
+        self._mapped.clear()
+        self._stored_revision.clear()
+        self._source_version.clear()
+        self._neighbours.clear()
+        self._prefetch_queue = []
+        self._modified.clear()
+        self._dirty.clear()
+        self._digests.clear()
+        # Файлы не закрываем явно: ими ещё могут пользоваться снимки,
+        # они закроются сами, когда на них не останется ссылок
+        self._scratch = None
+        self.pages_cleared.emit()
+
+    def stats(self):
+        return {
+            'cached_pages': len(self._documents),
+            'max_cached_pages': self.max_cached_pages,
+            'spilled_pages': len(self._spilled),
+            'mapped_pages': len(self._mapped),
+            'scratch_bytes': self._scratch.size if self._scratch is not None else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'spills': self.spills,
+            'prefetched': self.prefetched,
+            'dirty_pages': len(self._dirty),
+        }
+
+    def _evict(self, keep=None):
+        for page in list(self._documents):
+            if len(self._documents) <= self.max_cached_pages:
+                break
+            if page == keep or page == self._pinned or page in self._neighbours:
+                continue
+            document = self._documents.pop(page)
+            # Неизменённую страницу не нужно сериализовать повторно: её копия уже сохранена
+            stored = page in self._spilled or page in self._mapped
+            if not stored or document.revision() != self._stored_revision.get(page):
+                # Секция native_format, а не toHtml(): при возврате на страницу не нужен разбор HTML
+                section = encode_document(document)
+                digest = page_digest(section)
+                # Правки могли вернуть страницу к сохранённой копии: тогда она не дописывается снова
+                if self._digests.get(page) != digest:
+                    self._write_spilled(page, self._get_scratch().sections, section, digest)
+            if document.isModified():
+                self._modified.add(page)
+            self._stored_revision.pop(page, None)
+            document.deleteLater()
+
+    def _get_scratch(self):
+        if self._scratch is None:
+            self._scratch = ScratchFile()
+        return self._scratch
+
+    def _write_spilled(self, page, source, data, digest):
+        start, end = self._scratch.append(data)
+        self._spilled[page] = (source, start, end)
+        self._digests[page] = digest
+        self._source_version[page] = next(self._versions)
+        self._mapped.pop(page, None)
+        self.spills += 1
+
+    def _stored(self, page):
+        """(источник, start, end) сохранённой копии; у источника есть read() -> HTML и load()."""
+        return self._spilled.get(page) or self._mapped[page]
+
+    def _stored_reader(self, page):
+        source, start, end = self._stored(page)
+        return partial(source.read, start, end)
+
+    def _stored_section(self, page):
+        """Чтение готовой секции native_format или None, если копия страницы хранится как HTML."""
+        if page not in self._spilled and page not in self._mapped:
+            return None
+        source, start, end = self._stored(page)
+        if isinstance(source, (NativeFile, ScratchSections)):
+            return partial(source.section, start, end)
+        return None
+
+    def _stored_loader(self, page):
+        """Как _stored_reader, но страница native_format отдаётся разобранной секцией, а не HTML."""
+        source, start, end = self._stored(page)
+        return partial(source.load, start, end)
+
+
+class ScratchFile:
+    """Файл подкачки: копии страниц только дописываются в конец, поэтому смещения в снимках не устаревают.
+
+    Сам файл хранит HTML, сжатый zlib; sections - вид того же файла для секций native_format.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(prefix='text_processor_pages_')
+        self._lock = threading.Lock()
+        self.size = 0
+        self.sections = ScratchSections(self)
+
+    def append(self, data):
+        with self._lock:
+            self._file.seek(self.size)
+            self._file.write(data)
+            start = self.size
+            self.size += len(data)
+        return start, self.size
+
+    def read_bytes(self, start, end):
+        with self._lock:
+            self._file.seek(start)
+            return self._file.read(end - start)
+
+    def read(self, start, end):
+        return zlib.decompress(self.read_bytes(start, end)).decode('utf-8')
+
+    load = read
+
+
+class ScratchSections:
+    def __init__(self, scratch):
+        self.scratch = scratch
+
+    def section(self, start, end):
+        return self.scratch.read_bytes(start, end)
+
+    def load(self, start, end):
+        return decode_section(self.section(start, end))
+
+    def read(self, start, end):
+        return section_to_html(self.section(start, end))
+
+
+class PageReadJobSignals(QtCore.QObject):
+    page_read = QtCore.pyqtSignal(int, int, object)
+
+
+class PageReadJob(QtCore.QRunnable):
+    """Чтение и распаковка страницы вне потока интерфейса."""
+
+    def __init__(self, page, version, reader):
+        super().__init__()
+        self.page = page
+        self.version = version
+        self.reader = reader
+        self.signals = PageReadJobSignals()
+
+    def run(self):
+        self.signals.page_read.emit(self.page, self.version, self.reader())
+
+
+class PageSnapshot:
+    def __init__(self, sources):
+        self._sources = sources
+
+    def __len__(self):
+        return len(self._sources)
+
+    def keys(self):
+        return [page for page, source in self._sources]
+
+    def iter_html(self):
+        for page, source in self._sources:
+            yield page, source() if callable(source) else source
+
+
+def page_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
@@ -0,0 +1,114 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PAYMENT_SERVER_URL = os.environ.get('TEXT_PROCESSOR_PAYMENT_URL', 'http://localhost:8000')
+
+REQUEST_TIMEOUT = 10
+# Опрос статуса: задержка растёт от POLL_INITIAL_DELAY вдвое до POLL_MAX_DELAY
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 30.0
+POLL_TIMEOUT = 600  # 10 минут
+# Сколько секунд сервер может держать запрос статуса, если поддерживает long-poll
+LONG_POLL_WAIT = 25
+
+SUCCEEDED = 'succeeded'
+CANCELED = 'canceled'
+NOT_FOUND = 'not_found'
+TIMED_OUT = 'timed_out'
+FINAL_STATUSES = ("canceled", "expired", "failed")
+
+
+class PaymentCancelled(Exception):
+    pass
+
+
+class PaymentClient:
+    """Клиент сервера оплаты с переиспользуемым соединением.
+
+    Все запросы идут через одну requests.Session (keep-alive), статус
+    опрашивается с экспоненциальной задержкой и случайным разбросом.
+    Если сервер поддерживает long-poll (параметр wait и заголовок
+    X-Long-Poll в ответе), запрос держится на сервере до изменения
+    статуса и следующий отправляется сразу. cancel() прерывает ожидание.
+    """
+
+    def __init__(self, base_url=None, session=None):
+        self.base_url = (base_url or PAYMENT_SERVER_URL).rstrip('/')
+        self.session = session or requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.requests_sent = 0
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self.session.close()
+
+    def create_payment(self, amount):
+        """Возвращает (payment_url, payment_id); ожидается JSON {"payment_url": ..., "payment_id": ...}."""
+        response = self._get(f"/paying/{amount}", timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
+        return data.get("payment_url"), data.get("payment_id")
+
+    def wait_for_payment(self, payment_id, on_progress=None, timeout=POLL_TIMEOUT):
+        """Опрашивает /payment_status/{payment_id} до окончательного статуса.
+
+        on_progress(status, error) вызывается при каждом промежуточном ответе
+        или ошибке связи. Возвращает SUCCEEDED, CANCELED, NOT_FOUND или TIMED_OUT.
+        """
+        deadline = time.monotonic() + timeout
+        delay = POLL_INITIAL_DELAY
+
+        while time.monotonic() < deadline:
+            long_poll = False
+            try:
+                response = self._get(f"/payment_status/{payment_id}", params={'wait': LONG_POLL_WAIT},
+                                     timeout=(REQUEST_TIMEOUT, REQUEST_TIMEOUT + LONG_POLL_WAIT))
+                if response.status_code == 200:
+                    js = response.json()
+                    status = js.get("status")
+                    paid = js.get("paid")
+                    if status == SUCCEEDED or paid is True:
+                        return SUCCEEDED
+                    if status in FINAL_STATUSES:
+                        return CANCELED
+                    long_poll = response.headers.get('X-Long-Poll') == '1'
+                    self._notify(on_progress, status, None)
+                elif response.status_code == 404:
+                    return NOT_FOUND
+                else:
+                    self._notify(on_progress, None, f"код {response.status_code}")
+            except requests.RequestException as e:
+                if self.cancelled:
+                    raise PaymentCancelled()
+                self._notify(on_progress, None, e)
+
+            if long_poll:
+                delay = POLL_INITIAL_DELAY
+                continue
+            # Случайный разброс не даёт многим клиентам опрашивать сервер синхронно
+            if self._cancelled.wait(random.uniform(delay / 2, delay)):
+                raise PaymentCancelled()
+            delay = min(delay * 2, POLL_MAX_DELAY)
+
+        return TIMED_OUT
+
+    def _get(self, path, **kwargs):
+        if self.cancelled:
+            raise PaymentCancelled()
+        self.requests_sent += 1
+        return self.session.get(self.base_url + path, **kwargs)
+
+    def _notify(self, on_progress, status, error):
+        if on_progress is not None and not self.cancelled:
+            on_progress(status, error)
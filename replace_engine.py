@@ -0,0 +1,132 @@
+import json
+import re
+import time
+
+from PyQt5.QtGui import QTextCursor
+
+import text_workers
+from text_workers import document_positions, find_spans, utf16_length
+
+
+class ReplaceResult:
+    """Итог замены: количество вхождений, затраченное время (в секундах) и число затронутых страниц."""
+
+    def __init__(self, count, elapsed, pages=1):
+        self.count = count
+        self.elapsed = elapsed
+        self.pages = pages
+
+
+def build_pattern(text, case_sensitive=False, whole_word=False, regex=False):
+    """regex=True - text уже регулярное выражение (ошибка в нём - re.error), иначе ищется буквально."""
+    flags = 0 if case_sensitive else re.IGNORECASE
+    pattern = text if regex else re.escape(text)
+    if whole_word:
+        pattern = r'\b(?:' + pattern + r')\b'
+    return re.compile(pattern, flags)
+
+
+def load_rules(file_path):
+    """Правила пакетной замены из JSON: [{"pattern": ..., "replacement": ..., "case_sensitive": true}].
+
+    Возвращает список (regex, шаблон замены); в шаблоне допустимы ссылки на группы (\\1, \\g<name>).
+    """
+    with open(file_path, encoding='utf-8') as file:
+        data = json.load(file)
+    if not isinstance(data, list):
+        raise ValueError("Файл правил должен содержать список")
+    rules = []
+    for number, item in enumerate(data, 1):
+        try:
+            flags = 0 if item.get('case_sensitive', True) else re.IGNORECASE
+            rules.append((re.compile(item['pattern'], flags), str(item.get('replacement', ''))))
+        except (AttributeError, KeyError, TypeError, re.error) as error:
+            raise ValueError(f"Правило {number}: {error!r}") from error
+    return rules
+
+
+def replace_spans(cursor, text, spans, replacement):
+    """Заменяет найденные участки с конца документа к началу.
+
+    Работа с конца не сдвигает ещё не обработанные позиции, поэтому документ
+    не нужно сериализовать заново после каждой замены. Формат каждого
+    вхождения сохраняется так же, как раньше: берётся charFormat выделения
+    и накладывается на вставленный текст.
+    """
+    flat = [index for span in spans for index in span]
+    positions = document_positions(text, flat)
+    replace_positions(cursor, list(zip(positions[::2], positions[1::2])), replacement)
+
+
+def replace_positions(cursor, positions, replacement):
+    """Как replace_spans, но участки (start, end) уже в позициях документа."""
+    apply_edits(cursor, [(start, end, replacement) for start, end in positions])
+
+
+def apply_edits(cursor, edits):
+    """Правки (start, end, текст) в позициях документа, с конца к началу; формат участков сохраняется."""
+    for start, end, replacement in reversed(edits):
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+
+        current_format = cursor.charFormat()
+        cursor.insertText(replacement)
+        cursor.setPosition(start)
+        cursor.setPosition(start + utf16_length(replacement), QTextCursor.KeepAnchor)
+        cursor.mergeCharFormat(current_format)
+
+
+def replace_all(document, regex, replacement):
+    """Заменяет все совпадения regex в документе одним блоком редактирования."""
+    started = time.perf_counter()
+
+    text = document.toPlainText()
+    spans = find_spans(regex, text)
+
+    if spans:
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+        replace_spans(cursor, text, spans, replacement)
+        cursor.endEditBlock()
+
+    return ReplaceResult(len(spans), time.perf_counter() - started)
+
+
+def replace_in_pages(page_store, hits, replacement):
+    """Замена по готовым результатам поиска {page: [(start, end)]}.
+
+    Загружаются только страницы с совпадениями; каждая страница
+    меняется своим блоком редактирования.
+    """
+    started = time.perf_counter()
+    count = 0
+    for page, positions in hits.items():
+        cursor = QTextCursor(page_store.document(page))
+        cursor.beginEditBlock()
+        replace_positions(cursor, positions, replacement)
+        cursor.endEditBlock()
+        page_store.notify_changed(page)
+        count += len(positions)
+    return ReplaceResult(count, time.perf_counter() - started, len(hits))
+
+
+def substitute_in_pages(page_store, pages, rules):
+    """Пакетная замена по правилам (regex, шаблон) в страницах [(page, плоский текст)].
+
+    Замены вычисляются по плоскому тексту в пуле процессов (re держит GIL,
+    потоки здесь не помогли бы); в потоке интерфейса правки применяются
+    одним блоком редактирования на страницу. Ошибка в шаблоне замены
+    (re.error) возникает до изменения документа.
+    """
+    started = time.perf_counter()
+    edits = text_workers.substitute_pages(rules, pages)
+    count = 0
+    for page, steps in edits.items():
+        cursor = QTextCursor(page_store.document(page))
+        cursor.beginEditBlock()
+        for step in steps:
+            apply_edits(cursor, step)
+            count += len(step)
+        cursor.endEditBlock()
+        page_store.notify_changed(page)
+    return ReplaceResult(count, time.perf_counter() - started, len(edits))
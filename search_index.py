@@ -0,0 +1,258 @@
+import re
+
+from PyQt5 import QtCore
+from PyQt5.QtGui import QTextDocument
+
+import text_workers
+from native_format import NativePage
+from replace_engine import build_pattern
+from text_workers import document_positions, find_positions, utf16_length
+
+TOKEN_RE = re.compile(r'\w+')
+# Сколько найденных вхождений фоновый поиск отправляет за раз
+SEARCH_BATCH_SIZE = 500
+# Сколько последних запросов помнить для каждой страницы
+RESULT_CACHE_SIZE = 8
+
+
+class BlockText:
+    """Текст одного абзаца и (лениво) его индекс: слово в нижнем регистре -> смещения."""
+    __slots__ = ('text', 'length', '_tokens')
+
+    def __init__(self, text):
+        # Так же, как toPlainText(): неразрывный пробел и перевод строки внутри абзаца
+        self.text = text.replace('\xa0', ' ').replace('\u2028', '\n')
+        self.length = utf16_length(self.text)
+        self._tokens = None
+
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = {}
+            for match in TOKEN_RE.finditer(self.text):
+                self._tokens.setdefault(match.group().lower(), []).append(match.start())
+        return self._tokens
+
+
+class PageText:
+    """Плоский текст страницы по абзацам, обновляемый по contentsChange."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self._text = None
+        # Результаты последних запросов: повторный поиск по неизменённой странице ничего не пересчитывает
+        self._results = {}
+
+    @classmethod
+    def from_document(cls, document):
+        blocks = []
+        block = document.begin()
+        while block.isValid():
+            blocks.append(BlockText(block.text()))
+            block = block.next()
+        return cls(blocks)
+
+    @classmethod
+    def from_html(cls, html):
+        document = QTextDocument()
+        document.setHtml(html)
+        return cls.from_document(document)
+
+    @classmethod
+    def from_stored(cls, page):
+        """page - HTML или NativePage: текст страницы *.tpd берётся без сборки документа."""
+        if isinstance(page, NativePage):
+            return cls([BlockText(text) for text in page.block_texts()])
+        return cls.from_html(page)
+
+    def text(self):
+        if self._text is None:
+            self._text = '\n'.join(block.text for block in self.blocks)
+        return self._text
+
+    def apply_change(self, document, position, removed, added):
+        """Перечитывает только абзацы, затронутые правкой."""
+        first = document.findBlock(position)
+        last = document.findBlock(position + added)
+        if not first.isValid():
+            first = document.lastBlock()
+        if not last.isValid():
+            last = document.lastBlock()
+
+        delta = document.blockCount() - len(self.blocks)
+        first_number = first.blockNumber()
+        old_last_number = last.blockNumber() - delta
+
+        changed = []
+        block = first
+        while block.isValid() and block.blockNumber() <= last.blockNumber():
+            changed.append(BlockText(block.text()))
+            block = block.next()
+
+        self.blocks[first_number:old_last_number + 1] = changed
+        self._text = None
+        self._results.clear()
+
+    def find_pattern(self, regex):
+        """Все совпадения regex как (start, end) в позициях документа."""
+        spans = self.cached_pattern(regex)
+        if spans is None:
+            spans = find_positions(regex, self.text())
+            self.remember_pattern(regex, spans)
+        return spans
+
+    def cached_pattern(self, regex):
+        return self._results.get(('pattern', regex.pattern, regex.flags))
+
+    def remember_pattern(self, regex, spans):
+        if len(self._results) >= RESULT_CACHE_SIZE:
+            self._results.clear()
+        self._results[('pattern', regex.pattern, regex.flags)] = spans
+
+    def find_word(self, word, case_sensitive=False):
+        """Поиск слова целиком по индексу, без прохода регулярным выражением по тексту."""
+        key = ('word', word, case_sensitive)
+        if key not in self._results:
+            if len(self._results) >= RESULT_CACHE_SIZE:
+                self._results.clear()
+            self._results[key] = self._find_word(word, case_sensitive)
+        return self._results[key]
+
+    def _find_word(self, word, case_sensitive):
+        key = word.lower()
+        spans = []
+        offset = 0
+        for block in self.blocks:
+            starts = block.tokens().get(key)
+            if starts:
+                if case_sensitive:
+                    starts = [start for start in starts if block.text[start:start + len(word)] == word]
+                if block.length != len(block.text):
+                    ends = document_positions(block.text, [start + len(word) for start in starts])
+                    starts = document_positions(block.text, starts)
+                else:
+                    ends = [start + len(word) for start in starts]
+                spans.extend((offset + start, offset + end) for start, end in zip(starts, ends))
+            offset += block.length + 1
+        return spans
+
+
+class SearchIndex(QtCore.QObject):
+    """Кэш плоского текста и индексов слов для всех страниц хранилища."""
+
+    def __init__(self, page_store, parent=None):
+        super().__init__(parent)
+        self.page_store = page_store
+        self._pages = {}
+        page_store.page_changed.connect(self.on_page_changed)
+        page_store.pages_cleared.connect(self._pages.clear)
+
+    def page_text(self, page):
+        page_text = self._pages.get(page)
+        document = self.page_store.cached_document(page)
+        if page_text is not None and document is not None and len(page_text.blocks) != document.blockCount():
+            page_text = None
+        if page_text is None:
+            if document is not None:
+                page_text = PageText.from_document(document)
+            else:
+                page_text = PageText.from_stored(self.page_store.stored_page(page))
+            self._pages[page] = page_text
+        return page_text
+
+    def on_page_changed(self, page, position, removed, added):
+        page_text = self._pages.get(page)
+        if page_text is None:
+            return
+        document = self.page_store.cached_document(page)
+        if position < 0 or document is None:
+            del self._pages[page]
+        else:
+            page_text.apply_change(document, position, removed, added)
+
+    def search(self, search_text, case_sensitive=False, whole_word=False, pages=None):
+        """Возвращает список (page, start, end) по указанным страницам (по умолчанию - по всем)."""
+        hits = self.search_by_page(search_text, case_sensitive, whole_word, pages)
+        return [(page, start, end) for page, spans in hits.items() for start, end in spans]
+
+    def search_by_page(self, search_text, case_sensitive=False, whole_word=False, pages=None):
+        """{page: [(start, end)]} в порядке страниц; страницы без совпадений не попадают в результат."""
+        if pages is None:
+            pages = self.page_store.keys()
+
+        if whole_word and TOKEN_RE.fullmatch(search_text):
+            hits = {}
+            for page in pages:
+                spans = self.page_text(page).find_word(search_text, case_sensitive)
+                if spans:
+                    hits[page] = spans
+            return hits
+        return self.find_pattern(build_pattern(search_text, case_sensitive, whole_word), pages)
+
+    def find_pattern(self, regex, pages=None):
+        """Как search_by_page, но по готовому regex.
+
+        Страницы, для которых результата ещё нет в кэше, обрабатываются
+        одним проходом в пуле процессов (на больших документах - на всех ядрах).
+        """
+        if pages is None:
+            pages = self.page_store.keys()
+
+        hits = {}
+        missing = []
+        for page in pages:
+            page_text = self.page_text(page)
+            spans = page_text.cached_pattern(regex)
+            if spans is None:
+                missing.append((page, page_text.text()))
+            elif spans:
+                hits[page] = spans
+
+        found = text_workers.search_pages(regex, missing)
+        for page, _ in missing:
+            self._pages[page].remember_pattern(regex, found.get(page, []))
+        hits.update(found)
+        return {page: hits[page] for page in pages if page in hits}
+
+
+class SearchJobSignals(QtCore.QObject):
+    batch_found = QtCore.pyqtSignal(int, int, list)
+    search_finished = QtCore.pyqtSignal(int)
+
+
+class SearchJob(QtCore.QRunnable):
+    """Поиск regex по снимку текста страницы в пуле потоков.
+
+    Найденные участки отправляются пачками; cancel() прерывает поиск
+    на ближайшем совпадении.
+    """
+
+    def __init__(self, generation, page, text, regex):
+        super().__init__()
+        self.generation = generation
+        self.page = page
+        self.text = text
+        self.regex = regex
+        self.signals = SearchJobSignals()
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        batch = []
+        for match in self.regex.finditer(self.text):
+            if self._cancelled:
+                return
+            if match.end() > match.start():
+                batch.append(match.span())
+            if len(batch) >= SEARCH_BATCH_SIZE:
+                self._send(batch)
+                batch = []
+        if batch:
+            self._send(batch)
+        if not self._cancelled:
+            self.signals.search_finished.emit(self.generation)
+
+    def _send(self, spans):
+        positions = document_positions(self.text, [index for span in spans for index in span])
+        self.signals.batch_found.emit(self.generation, self.page, list(zip(positions[::2], positions[1::2])))
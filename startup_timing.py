@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+
+# Засекается до импорта Qt, чтобы в отчёт попало и время загрузки библиотек
+STARTED = time.perf_counter()
+
+from PyQt5 import QtCore
+
+# TEXT_PROCESSOR_STARTUP_TIMING=1 печатает в stderr, на что ушло время до первой отрисовки окна
+ENABLED = os.environ.get('TEXT_PROCESSOR_STARTUP_TIMING') == '1'
+
+
+class StartupTimer:
+    """Отметки времени запуска: каждая отметка - время от предыдущей и от начала."""
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.marks = []
+
+    def mark(self, label):
+        self.marks.append((label, time.perf_counter()))
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        previous = self.started
+        for label, moment in self.marks:
+            print(f"[startup] {label:<24} +{(moment - previous) * 1000:7.1f} ms  "
+                  f"{(moment - self.started) * 1000:7.1f} ms", file=stream)
+            previous = moment
+
+
+class FirstPaintFilter(QtCore.QObject):
+    """Ставит отметку и печатает отчёт при первой отрисовке окна."""
+
+    def __init__(self, timer, parent):
+        super().__init__(parent)
+        self.timer = timer
+
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint:
+            watched.removeEventFilter(self)
+            self.timer.mark("первая отрисовка")
+            self.timer.report()
+        return False
+
+
+_timer = StartupTimer(STARTED)
+
+
+def mark(label):
+    if ENABLED:
+        _timer.mark(label)
+
+
+def report_on_first_paint(window):
+    if ENABLED:
+        window.installEventFilter(FirstPaintFilter(_timer, window))
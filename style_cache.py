@@ -0,0 +1,122 @@
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtGui import QTextBlockFormat, QTextCharFormat
+
+import style_repository
+
+
+def build_char_format(style):
+    format = QTextCharFormat()
+    format.setFontFamily(style.font_family)
+    format.setFontPointSize(style.font_size)
+    format.setFontWeight(QtGui.QFont.Bold if style.bold else QtGui.QFont.Normal)
+    format.setFontItalic(style.italic)
+    format.setFontUnderline(style.underlined)
+    format.setForeground(QtGui.QColor(style.color))
+    return format
+
+
+def build_block_format(style):
+    format = QTextBlockFormat()
+    format.setLineHeight(style.line_spacing * 100, QTextBlockFormat.ProportionalHeight)
+    return format
+
+
+class StyleCache(QtCore.QObject):
+    """Стили, загруженные из базы один раз, с готовыми форматами символов и абзацев.
+
+    Добавление стиля через add_style() сразу попадает в кэш и сообщается
+    сигналом style_added(row); invalidate() перечитывает базу целиком.
+    """
+    style_added = QtCore.pyqtSignal(int)
+    styles_reset = QtCore.pyqtSignal()
+
+    def __init__(self, repository, parent=None):
+        super().__init__(parent)
+        self.repository = repository
+        self._styles = OrderedDict()
+        self._formats = {}
+        self.reload()
+
+    def reload(self):
+        self._styles = OrderedDict()
+        for style in self.repository.styles():
+            self._styles.setdefault(style.name, style)
+        self._formats.clear()
+
+    def invalidate(self):
+        self.reload()
+        self.styles_reset.emit()
+
+    def names(self):
+        return list(self._styles)
+
+    def __len__(self):
+        return len(self._styles)
+
+    def style(self, name):
+        return self._styles.get(name)
+
+    def char_format(self, name):
+        return QTextCharFormat(self._prebuilt(name)[0])
+
+    def block_format(self, name):
+        return QTextBlockFormat(self._prebuilt(name)[1])
+
+    def add_style(self, name, font_family, font_size, bold, italic, underlined, line_spacing, color):
+        style = self.repository.add_style(name, font_family, font_size, bold, italic, underlined, line_spacing,
+                                          color)
+        if name in self._styles:
+            # Имя уже было в списке: строка не добавляется, а запрос по имени вернёт первую запись, как и раньше
+            return style
+        self._styles[name] = style
+        self.style_added.emit(len(self._styles) - 1)
+        return style
+
+    def _prebuilt(self, name):
+        formats = self._formats.get(name)
+        if formats is None:
+            style = self._styles[name]
+            formats = self._formats[name] = (build_char_format(style), build_block_format(style))
+        return formats
+
+
+class StyleListModel(QtCore.QAbstractListModel):
+    """Список названий стилей для QListView; при добавлении стиля вставляется одна строка."""
+
+    def __init__(self, style_cache, parent=None):
+        super().__init__(parent)
+        self.style_cache = style_cache
+        self._names = style_cache.names()
+        style_cache.style_added.connect(self.on_style_added)
+        style_cache.styles_reset.connect(self.on_styles_reset)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._names)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role == QtCore.Qt.DisplayRole:
+            return self._names[index.row()]
+        return None
+
+    def on_style_added(self, row):
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._names.insert(row, self.style_cache.names()[row])
+        self.endInsertRows()
+
+    def on_styles_reset(self):
+        self.beginResetModel()
+        self._names = self.style_cache.names()
+        self.endResetModel()
+
+
+_style_cache = None
+
+
+def get_style_cache():
+    """Общий кэш стилей приложения; загружается из базы при первом обращении."""
+    global _style_cache
+    if _style_cache is None:
+        _style_cache = StyleCache(style_repository.get_repository())
+    return _style_cache
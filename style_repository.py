@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+
+DATABASE_PATH = 'text_processor.db'
+# Сколько ждать (в секундах), если базу в этот момент пишет другой процесс
+BUSY_TIMEOUT = 5.0
+
+SELECT_NAMES = "SELECT name FROM styles ORDER BY id"
+SELECT_ALL = "SELECT id, name, shrift, pt, bold, italic, underlined, interval, color FROM styles ORDER BY id"
+SELECT_BY_NAME = ("SELECT id, name, shrift, pt, bold, italic, underlined, interval, color FROM styles "
+                  "WHERE name = ?")
+INSERT_STYLE = ("INSERT INTO styles(name, shrift, pt, bold, italic, underlined, interval, color) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+class Style:
+    """Строка таблицы styles с уже разобранными типами."""
+    __slots__ = ('id', 'name', 'font_family', 'font_size', 'bold', 'italic', 'underlined', 'line_spacing', 'color')
+
+    def __init__(self, id, name, font_family, font_size, bold, italic, underlined, line_spacing, color):
+        self.id = id
+        self.name = name
+        self.font_family = font_family
+        self.font_size = font_size
+        self.bold = bold
+        self.italic = italic
+        self.underlined = underlined
+        self.line_spacing = line_spacing
+        self.color = color
+
+    @classmethod
+    def from_row(cls, row):
+        # В базе всё хранится текстом: булевы значения - строками "True"/"False"
+        id, name, shrift, pt, bold, italic, underlined, interval, color = row
+        return cls(id, name, shrift, int(float(pt)), bold == "True", italic == "True", underlined == "True",
+                   float(interval), color)
+
+
+class StyleRepository:
+    """Доступ к таблице стилей через одно общее соединение.
+
+    Соединение открывается один раз в режиме WAL, запросы
+    параметризованы и кэшируются sqlite3, запись сериализуется блокировкой.
+    """
+
+    def __init__(self, path=DATABASE_PATH):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+        self._lock = threading.Lock()
+
+    def style_names(self):
+        with self._lock:
+            return [row[0] for row in self._connection.execute(SELECT_NAMES)]
+
+    def styles(self):
+        with self._lock:
+            return [Style.from_row(row) for row in self._connection.execute(SELECT_ALL)]
+
+    def get_style(self, name):
+        with self._lock:
+            row = self._connection.execute(SELECT_BY_NAME, (name,)).fetchone()
+        return Style.from_row(row) if row else None
+
+    def add_style(self, name, font_family, font_size, bold, italic, underlined, line_spacing, color):
+        with self._lock, self._connection:
+            cursor = self._connection.execute(INSERT_STYLE, (name, font_family, str(font_size), str(bold),
+                                                             str(italic), str(underlined), str(line_spacing),
+                                                             color))
+        return Style(cursor.lastrowid, name, font_family, int(font_size), bool(bold), bool(italic), bool(underlined),
+                     float(line_spacing), color)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    """Общий на всё приложение репозиторий стилей; создаётся при первом обращении."""
+    global _repository
+    with _repository_lock:
+        if _repository is None:
+            _repository = StyleRepository(DATABASE_PATH)
+        return _repository
@@ -0,0 +1,140 @@
+"""Обработка текста страниц в отдельных процессах.
+
+Модуль не импортирует Qt: его функции выполняются в процессах пула,
+куда передаются только плоский текст страниц и скомпилированные regex.
+"""
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# Символы вне BMP: в QTextDocument они занимают две позиции (UTF-16)
+ASTRAL_RE = re.compile('[\U00010000-\U0010FFFF]')
+WORKERS = os.cpu_count() or 1
+# Сколько страниц уходит в процесс одной задачей
+CHUNK_PAGES = 16
+# Меньше этого объёма текста поиск идёт в текущем процессе: передача в пул обошлась бы дороже самого поиска
+PARALLEL_MIN_CHARS = 1 << 20
+
+
+def document_positions(text, indexes):
+    """Переводит индексы строки Python в позиции QTextDocument.
+
+    Документ считает символы в UTF-16, поэтому символы вне BMP (эмодзи и т.п.)
+    занимают две позиции. Для текста без таких символов индексы совпадают.
+    """
+    if text.isascii() or not ASTRAL_RE.search(text):
+        return list(indexes)
+
+    positions = []
+    offset = 0
+    last = 0
+    for index in sorted(set(indexes)):
+        offset += len(ASTRAL_RE.findall(text, last, index))
+        last = index
+        positions.append((index, index + offset))
+    mapping = dict(positions)
+    return [mapping[index] for index in indexes]
+
+
+def utf16_length(text):
+    return len(text) + len(ASTRAL_RE.findall(text))
+
+
+def find_spans(regex, text):
+    """Один проход по тексту: список (start, end) всех непустых совпадений."""
+    return [match.span() for match in regex.finditer(text) if match.end() > match.start()]
+
+
+def find_positions(regex, text):
+    """Как find_spans, но в позициях документа."""
+    spans = find_spans(regex, text)
+    positions = document_positions(text, [index for span in spans for index in span])
+    return list(zip(positions[::2], positions[1::2]))
+
+
+def search_chunk(regex, pages):
+    return [(page, find_positions(regex, text)) for page, text in pages]
+
+
+def substitute_text(rules, text):
+    """Правила (regex, шаблон замены) по очереди, как re.sub; каждое - по результату предыдущего.
+
+    Для каждого правила возвращается список правок (start, end, текст) в позициях
+    документа после предыдущих правил. Совпадения, которые заменились бы на тот же
+    текст, пропускаются, а общие начало и конец совпадения и замены в правку
+    не входят. Если ничего не меняется, возвращается пустой список.
+    """
+    steps = []
+    for regex, template in rules:
+        edits = []
+        pieces = []
+        last = 0
+        for match in regex.finditer(text):
+            matched = match.group()
+            replacement = match.expand(template)
+            if replacement == matched:
+                continue
+            start, end = match.span()
+            pieces.append(text[last:start])
+            pieces.append(replacement)
+            last = end
+            # Общие начало и конец совпадения и замены не переписываются: у них остаётся свой формат
+            prefix = len(os.path.commonprefix((matched, replacement)))
+            limit = min(len(matched), len(replacement)) - prefix
+            suffix = 0
+            while suffix < limit and matched[-1 - suffix] == replacement[-1 - suffix]:
+                suffix += 1
+            edits.append((start + prefix, end - suffix, replacement[prefix:len(replacement) - suffix]))
+        if edits:
+            positions = document_positions(text, [index for start, end, _ in edits for index in (start, end)])
+            edits = [(positions[2 * i], positions[2 * i + 1], replacement)
+                     for i, (_, _, replacement) in enumerate(edits)]
+            pieces.append(text[last:])
+            text = ''.join(pieces)
+        steps.append(edits)
+    return steps if any(steps) else []
+
+
+def substitute_chunk(rules, pages):
+    return [(page, substitute_text(rules, text)) for page, text in pages]
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def parallel_map(function, items, total_chars):
+    """function(chunk) по кускам items в пуле процессов; маленькие объёмы - в текущем процессе."""
+    if WORKERS == 1 or total_chars < PARALLEL_MIN_CHARS:
+        return [function(items)] if items else []
+    return list(get_pool().map(function, chunks(items, CHUNK_PAGES)))
+
+
+def search_pages(regex, pages):
+    """Ищет regex в страницах [(page, text)]; возвращает {page: [(start, end)]} только для страниц с совпадениями."""
+    results = parallel_map(partial(search_chunk, regex), pages, sum(len(text) for _, text in pages))
+    return {page: spans for chunk in results for page, spans in chunk if spans}
+
+
+def substitute_pages(rules, pages):
+    """substitute_text() для страниц [(page, text)]; {page: правки по правилам} только для изменённых страниц.
+
+    Страницы обрабатываются всеми правилами в одном процессе, поэтому пакет
+    из многих правил масштабируется по числу страниц, а не по числу правил.
+    """
+    total_chars = sum(len(text) for _, text in pages) * len(rules)
+    results = parallel_map(partial(substitute_chunk, rules), pages, total_chars)
+    return {page: steps for chunk in results for page, steps in chunk if steps}
+
+
+_pool = None
+
+
+def get_pool():
+    """Общий пул процессов; процессы запускаются заново (spawn), а не копируют процесс с потоками Qt."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool